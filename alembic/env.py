@@ -15,6 +15,10 @@ from alembic import context
 # pylint: disable=no-member
 config = context.config
 
+# The database scanpfts.py uses, if set in the environment
+if os.environ.get('LUNGDB_DB_URL'):
+    config.set_main_option('sqlalchemy.url', os.environ['LUNGDB_DB_URL'].replace('%', '%%'))
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 fileConfig(config.config_file_name)
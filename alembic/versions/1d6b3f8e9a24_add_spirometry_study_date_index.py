@@ -0,0 +1,25 @@
+"""Add spirometry study date index
+
+Revision ID: 1d6b3f8e9a24
+Revises: f5a9c2d7e413
+Create Date: 2026-10-18 22:31:54.207316
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '1d6b3f8e9a24'
+down_revision = 'f5a9c2d7e413'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_index('ix_spirometry_study_date', 'spirometry', ['study_date'])
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_index('ix_spirometry_study_date', table_name='spirometry')
@@ -0,0 +1,113 @@
+"""Read stored dates day first
+
+Revision ID: 3b8e1c6d9f42
+Revises: 9c4f7a2e5d31
+Create Date: 2026-10-19 11:26:08.350914
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e1c6d9f42'
+down_revision = '9c4f7a2e5d31'
+branch_labels = None
+depends_on = None
+
+# Columns identifying a study in each table, as in the unique indexes
+TABLES = {'spirometry': ['subject_id', 'study_date'],
+          'lungfunc': ['subject_id', 'study_date'],
+          'physiology': ['subject_id', 'study_date'],
+          'oximetry': ['subject_id', 'study_date', 'device']}
+
+
+def _table(name: str, *cols):
+    types = {'study_date': sa.Date, 'dob': sa.Date, 'device': sa.String, 'row_ids': sa.Text, 'path': sa.Text}
+    return sa.table(name, *[sa.column(c, types.get(c, sa.Integer)) for c in cols])
+
+
+def _swapped(d):
+    """
+    d read month first as it would have been day first, or None if that is
+    the same date. Dates were only read month first when the day was 12 or less
+    """
+    if d is None or d.day > 12 or d.day == d.month:
+        return None
+    return d.replace(month = d.day, day = d.month)
+
+
+def upgrade():
+    # pylint: disable=no-member
+    # Dates used to be read month first, so a study on 12/06/2019 was stored
+    # as 6 December. Rows written since are in the ingest manifest, so the
+    # rows that aren't came from the old code and have their day and month
+    # swapped back. A row whose corrected study is already stored (from a
+    # rescan) is deleted instead
+    conn = op.get_bind()
+    manifest = _table('ingest_manifest', 'path', 'row_ids')
+    listed = {table: set() for table in TABLES}
+    for (row_ids,) in conn.execute(sa.select(manifest.c.row_ids).where(manifest.c.row_ids.isnot(None))):
+        for table, ids in json.loads(row_ids).items():
+            listed.setdefault(table, set()).update(ids)
+
+    subjects = set()
+    for table, key in TABLES.items():
+        t = _table(table, 'id', *key)
+        rows = conn.execute(sa.select(t).where(t.c.study_date.isnot(None))).mappings().all()
+        fixes = {r['id']: _swapped(r['study_date']) for r in rows if not r['id'] in listed[table]}
+        fixes = {i: d for i, d in fixes.items() if d is not None}
+        if len(fixes) == 0:
+            continue
+        stored = {tuple(r[c] for c in key) for r in rows if not r['id'] in fixes}
+        moved = dict()
+        deleted = []
+        for r in rows:
+            if not r['id'] in fixes:
+                continue
+            new = tuple((fixes[r['id']] if c == 'study_date' else r[c]) for c in key)
+            if new in stored:
+                deleted.append(r['id'])
+            else:
+                stored.add(new)
+                moved[r['id']] = fixes[r['id']]
+            subjects.add(r['subject_id'])
+
+        if len(deleted) > 0:
+            if table == 'spirometry':
+                derived = _table('derived', 'spiro_id')
+                conn.execute(derived.delete().where(derived.c.spiro_id.in_(deleted)))
+            conn.execute(t.delete().where(t.c.id.in_(deleted)))
+        if len(moved) > 0:
+            # Cleared first so rows swapping dates with each other don't collide
+            conn.execute(t.update().where(t.c.id.in_(list(moved))).values(study_date = None))
+            conn.execute(t.update().where(t.c.id == sa.bindparam('_id')).values(study_date = sa.bindparam('_date')),
+                         [{'_id': i, '_date': d} for i, d in moved.items()])
+
+    # Dates of birth of the patients those rows belong to
+    patient = _table('patient', 'id', 'dob')
+    if len(subjects) > 0:
+        dobs = conn.execute(sa.select(patient).where(patient.c.id.in_(sorted(subjects)))).all()
+        fixes = [{'_id': i, '_dob': _swapped(dob)} for i, dob in dobs if _swapped(dob) is not None]
+        if len(fixes) > 0:
+            conn.execute(patient.update().where(patient.c.id == sa.bindparam('_id')).values(dob = sa.bindparam('_dob')),
+                         fixes)
+
+    # Lung function follows its spirometry, and results computed from the old
+    # dates are recomputed by the next analysepfts.py run
+    op.execute('UPDATE lungfunc SET spiro_id = (SELECT MAX(s.id) FROM spirometry s '
+               'WHERE s.subject_id = lungfunc.subject_id AND s.study_date = lungfunc.study_date) '
+               'WHERE study_date IS NOT NULL AND spiro_id IS NOT NULL')
+    if len(subjects) > 0:
+        for name in ['derived', 'trend']:
+            t = _table(name, 'subject_id')
+            conn.execute(t.delete().where(t.c.subject_id.in_(sorted(subjects))))
+        op.execute('DELETE FROM cohort_summary')
+
+
+def downgrade():
+    # pylint: disable=no-member
+    # Which dates were corrected isn't recorded, so they are left as they are
+    pass
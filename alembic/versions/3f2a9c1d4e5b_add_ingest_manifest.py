@@ -0,0 +1,38 @@
+"""Add ingest manifest
+
+Revision ID: 3f2a9c1d4e5b
+Revises: 7b51594d33f2
+Create Date: 2026-10-18 09:12:41.203518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d4e5b'
+down_revision = '7b51594d33f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_table('ingest_manifest',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('path', sa.String(length=500), nullable=True),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('mtime', sa.Float(), nullable=True),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('parser', sa.String(length=30), nullable=True),
+        sa.Column('outcome', sa.String(length=30), nullable=True),
+        sa.Column('row_ids', sa.Text(), nullable=True),
+        sa.Column('scanned', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('path')
+    )
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_table('ingest_manifest')
@@ -0,0 +1,51 @@
+"""Add import job tables
+
+Revision ID: 4c1e8f7b2a95
+Revises: b6f40d2a8c37
+Create Date: 2026-10-18 19:12:27.518304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1e8f7b2a95'
+down_revision = 'b6f40d2a8c37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_table('import_job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('root', sa.String(length=500), nullable=True),
+        sa.Column('options', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('walked', sa.Boolean(), nullable=True),
+        sa.Column('files', sa.Integer(), nullable=True),
+        sa.Column('done', sa.Integer(), nullable=True),
+        sa.Column('started', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.Column('finished', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('import_file',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=True),
+        sa.Column('seq', sa.Integer(), nullable=True),
+        sa.Column('path', sa.String(length=500), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('outcome', sa.String(length=30), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['import_job.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_import_file_job_seq', 'import_file', ['job_id', 'seq'], unique=True)
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_index('ix_import_file_job_seq', table_name='import_file')
+    op.drop_table('import_file')
+    op.drop_table('import_job')
@@ -0,0 +1,45 @@
+"""Add derived table
+
+Revision ID: 5d8b2e6f0c13
+Revises: c93e1f0a7d52
+Create Date: 2026-10-18 15:27:54.061392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8b2e6f0c13'
+down_revision = 'c93e1f0a7d52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_table('derived',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('spiro_id', sa.Integer(), nullable=True),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('study_date', sa.Date(), nullable=True),
+        sa.Column('age', sa.Float(), nullable=True),
+        sa.Column('bmi', sa.Float(), nullable=True),
+        sa.Column('fev1_fvc', sa.Float(), nullable=True),
+        sa.Column('fev1_fvc_post', sa.Float(), nullable=True),
+        sa.Column('fev1_z', sa.Float(), nullable=True),
+        sa.Column('fvc_z', sa.Float(), nullable=True),
+        sa.Column('fev1_fvc_z', sa.Float(), nullable=True),
+        sa.Column('computed', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['spiro_id'], ['spirometry.id'], ),
+        sa.ForeignKeyConstraint(['subject_id'], ['patient.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('spiro_id')
+    )
+    op.create_index('ix_derived_subject_date', 'derived', ['subject_id', 'study_date'], unique=False)
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_index('ix_derived_subject_date', table_name='derived')
+    op.drop_table('derived')
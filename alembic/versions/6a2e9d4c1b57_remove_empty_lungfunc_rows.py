@@ -0,0 +1,53 @@
+"""Remove empty lungfunc rows
+
+Revision ID: 6a2e9d4c1b57
+Revises: 1d6b3f8e9a24
+Create Date: 2026-10-19 09:12:40.581337
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2e9d4c1b57'
+down_revision = '1d6b3f8e9a24'
+branch_labels = None
+depends_on = None
+
+MEASURES = ['tlco', 'vasb', 'kco', 'frc', 'vc', 'tlc', 'rv', 'tlcrv']
+
+
+def upgrade():
+    # pylint: disable=no-member
+    # Spirometry only reports were given a lungfunc row with every value NULL
+    conn = op.get_bind()
+    empty = ' AND '.join('{0} IS NULL'.format(m) for m in MEASURES)
+    ids = {row[0] for row in conn.execute(sa.text('SELECT id FROM lungfunc WHERE ' + empty))}
+    if len(ids) == 0:
+        return
+    op.execute('DELETE FROM lungfunc WHERE ' + empty)
+
+    # Take the deleted rows out of the ingest manifest
+    for path, row_ids in conn.execute(sa.text('SELECT path, row_ids FROM ingest_manifest '
+                                              'WHERE row_ids LIKE \'%"lungfunc"%\'')).all():
+        tables = json.loads(row_ids)
+        kept = [i for i in tables['lungfunc'] if not i in ids]
+        if len(kept) == len(tables['lungfunc']):
+            continue
+        tables['lungfunc'] = kept
+        if len(kept) == 0:
+            del tables['lungfunc']
+        conn.execute(sa.text('UPDATE ingest_manifest SET row_ids = :row_ids WHERE path = :path'),
+                     {'row_ids': json.dumps(tables), 'path': path})
+
+    # Summaries counted them as full lung function - recomputed by the next refresh
+    op.execute('DELETE FROM cohort_summary')
+
+
+def downgrade():
+    # pylint: disable=no-member
+    # The rows held no values, so there is nothing to put back
+    pass
@@ -0,0 +1,41 @@
+"""Add quarantine table
+
+Revision ID: 8e3d5a1c6f20
+Revises: 4c1e8f7b2a95
+Create Date: 2026-10-18 20:03:55.184629
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3d5a1c6f20'
+down_revision = '4c1e8f7b2a95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_table('quarantine',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('path', sa.String(length=500), nullable=True),
+        sa.Column('size', sa.Integer(), nullable=True),
+        sa.Column('mtime', sa.Float(), nullable=True),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('outcome', sa.String(length=30), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('snippet', sa.Text(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('first_failed', sa.DateTime(), nullable=True),
+        sa.Column('last_failed', sa.DateTime(), nullable=True),
+        sa.Column('next_retry', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('path')
+    )
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_table('quarantine')
@@ -0,0 +1,32 @@
+"""Add device to oximetry study index
+
+Revision ID: 9c4f7a2e5d31
+Revises: 6a2e9d4c1b57
+Create Date: 2026-10-19 10:03:27.914502
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4f7a2e5d31'
+down_revision = '6a2e9d4c1b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    # Oximetry from different devices on the same day are separate studies
+    op.drop_index('ix_oximetry_subject_date', table_name='oximetry')
+    op.create_index('ix_oximetry_subject_date', 'oximetry', ['subject_id', 'study_date', 'device'], unique=True)
+
+
+def downgrade():
+    # pylint: disable=no-member
+    # Keep only the latest study of the day so the index can be built
+    op.execute('DELETE FROM oximetry WHERE study_date IS NOT NULL AND id NOT IN '
+               '(SELECT MAX(id) FROM oximetry WHERE study_date IS NOT NULL '
+               'GROUP BY subject_id, study_date)')
+    op.drop_index('ix_oximetry_subject_date', table_name='oximetry')
+    op.create_index('ix_oximetry_subject_date', 'oximetry', ['subject_id', 'study_date'], unique=True)
@@ -0,0 +1,36 @@
+"""Add oximetry table
+
+Revision ID: a41c7e2b9d10
+Revises: 3f2a9c1d4e5b
+Create Date: 2026-10-18 10:41:07.552190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c7e2b9d10'
+down_revision = '3f2a9c1d4e5b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_table('oximetry',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('study_date', sa.Date(), nullable=True),
+        sa.Column('device', sa.String(length=20), nullable=True),
+        sa.Column('odi', sa.Float(), nullable=True),
+        sa.Column('hri', sa.Float(), nullable=True),
+        sa.Column('report', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['subject_id'], ['patient.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_table('oximetry')
@@ -0,0 +1,40 @@
+"""Add cohort summary table
+
+Revision ID: b6f40d2a8c37
+Revises: e27a4c9b1f86
+Create Date: 2026-10-18 18:05:41.392817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6f40d2a8c37'
+down_revision = 'e27a4c9b1f86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_table('cohort_summary',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Date(), nullable=True),
+        sa.Column('sex', sa.String(length=10), nullable=True),
+        sa.Column('age_band', sa.String(length=10), nullable=True),
+        sa.Column('studies', sa.Integer(), nullable=True),
+        sa.Column('with_lungfunc', sa.Integer(), nullable=True),
+        sa.Column('fev1_pp_n', sa.Integer(), nullable=True),
+        sa.Column('fev1_pp_median', sa.Float(), nullable=True),
+        sa.Column('last_id', sa.Integer(), nullable=True),
+        sa.Column('computed', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_cohort_summary_month_group', 'cohort_summary', ['month', 'sex', 'age_band'], unique=True)
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_index('ix_cohort_summary_month_group', table_name='cohort_summary')
+    op.drop_table('cohort_summary')
@@ -0,0 +1,44 @@
+"""Add subject and study date indexes
+
+Revision ID: c93e1f0a7d52
+Revises: a41c7e2b9d10
+Create Date: 2026-10-18 14:02:31.418733
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c93e1f0a7d52'
+down_revision = 'a41c7e2b9d10'
+branch_labels = None
+depends_on = None
+
+# Columns identifying a study in each table - oximetry from different devices
+# on the same day are separate studies
+TABLES = {'lungfunc': ['subject_id', 'study_date'],
+          'physiology': ['subject_id', 'study_date'],
+          'oximetry': ['subject_id', 'study_date', 'device'],
+          'spirometry': ['subject_id', 'study_date']}
+
+
+def upgrade():
+    # pylint: disable=no-member
+    # Keep only the latest row of any duplicated study so the unique indexes
+    # can be built, pointing lung function rows at the spirometry kept
+    for table, key in TABLES.items():
+        op.execute('DELETE FROM {0} WHERE study_date IS NOT NULL AND id NOT IN '
+                   '(SELECT MAX(id) FROM {0} WHERE study_date IS NOT NULL '
+                   'GROUP BY {1})'.format(table, ', '.join(key)))
+    op.execute('UPDATE lungfunc SET spiro_id = (SELECT MAX(s.id) FROM spirometry s '
+               'WHERE s.subject_id = lungfunc.subject_id AND s.study_date = lungfunc.study_date) '
+               'WHERE study_date IS NOT NULL AND spiro_id IS NOT NULL')
+
+    for table, key in TABLES.items():
+        op.create_index('ix_{0}_subject_date'.format(table), table, key, unique=True)
+
+
+def downgrade():
+    # pylint: disable=no-member
+    for table in TABLES:
+        op.drop_index('ix_{0}_subject_date'.format(table), table_name=table)
@@ -0,0 +1,42 @@
+"""Add trend table
+
+Revision ID: e27a4c9b1f86
+Revises: 5d8b2e6f0c13
+Create Date: 2026-10-18 16:48:12.730254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e27a4c9b1f86'
+down_revision = '5d8b2e6f0c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_table('trend',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('measure', sa.String(length=20), nullable=True),
+        sa.Column('n', sa.Integer(), nullable=True),
+        sa.Column('last_id', sa.Integer(), nullable=True),
+        sa.Column('first_date', sa.Date(), nullable=True),
+        sa.Column('last_date', sa.Date(), nullable=True),
+        sa.Column('slope', sa.Float(), nullable=True),
+        sa.Column('intercept', sa.Float(), nullable=True),
+        sa.Column('resid_sd', sa.Float(), nullable=True),
+        sa.Column('computed', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['subject_id'], ['patient.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_trend_subject_measure', 'trend', ['subject_id', 'measure'], unique=True)
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_index('ix_trend_subject_measure', table_name='trend')
+    op.drop_table('trend')
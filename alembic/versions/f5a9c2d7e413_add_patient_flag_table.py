@@ -0,0 +1,39 @@
+"""Add patient flag table
+
+Revision ID: f5a9c2d7e413
+Revises: 8e3d5a1c6f20
+Create Date: 2026-10-18 20:47:09.663150
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5a9c2d7e413'
+down_revision = '8e3d5a1c6f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pylint: disable=no-member
+    op.create_table('patient_flag',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('patient_id', sa.Integer(), nullable=True),
+        sa.Column('other_id', sa.Integer(), nullable=True),
+        sa.Column('kind', sa.String(length=20), nullable=True),
+        sa.Column('detail', sa.Text(), nullable=True),
+        sa.Column('source', sa.String(length=20), nullable=True),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['patient_id'], ['patient.id'], ),
+        sa.ForeignKeyConstraint(['other_id'], ['patient.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_patient_flag_patient', 'patient_flag', ['patient_id'], unique=False)
+
+
+def downgrade():
+    # pylint: disable=no-member
+    op.drop_index('ix_patient_flag_patient', table_name='patient_flag')
+    op.drop_table('patient_flag')
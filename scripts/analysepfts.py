@@ -0,0 +1,42 @@
+# Refresh the tables computed from the lung function results
+import sys
+import os
+folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, folder)
+
+import argparse
+import logging
+
+from scripts.database.engine import Database, DB_URL_ENV, DEFAULT_DB_URL
+import scripts.analysis.derived as derived
+import scripts.analysis.trends as trends
+import scripts.analysis.summary as summary
+
+logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO, \
+                    filename='./logs/lungdb.log')
+
+def main():
+    ap = argparse.ArgumentParser(description='Bring the derived results tables up to date')
+    ap.add_argument('--full', action='store_true', \
+                    help='Recompute everything rather than only new and changed studies')
+    ap.add_argument('--db', default=None, metavar='URL', \
+                    help='Database url (default ${0} or {1})'.format(DB_URL_ENV, DEFAULT_DB_URL))
+    ap.add_argument('--report', action='store_true', \
+                    help='Print studies per month from the cohort summary afterwards')
+    args = ap.parse_args()
+
+    engine = Database(args.db).engine
+    n = derived.refresh(engine, args.full)
+    print('Derived metrics: {0} studies computed'.format(n))
+    n = trends.refresh(engine, args.full)
+    print('Trends: {0} patient measures refitted'.format(n))
+    n = summary.refresh(engine, args.full)
+    print('Cohort summary: {0} months computed'.format(n))
+
+    if args.report:
+        print('Month    Studies  Lung function  Spirometry only')
+        for month, studies, with_lf, spiro_only in summary.studies_per_month(engine):
+            print('{0:%Y-%m}  {1:7d}  {2:13d}  {3:15d}'.format(month, studies, with_lf, spiro_only))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# Derived metrics - ratios, BMI, age and reference z-scores for each study
+
+import scripts.database.db as db
+from scripts.analysis.export import to_array, numpy_dtype
+from sqlalchemy import select, delete, and_
+import numpy as np
+import datetime as dt
+import logging
+
+DEFAULT_CHUNK = 50000
+
+# ECSC 1993 (Quanjer) adult reference equations - height in metres, age in
+# years: (h, k, c, rsd) with predicted = h * height + k * age + c and
+# z = (measured - predicted) / rsd
+# FEV1 and FVC in litres, FEV1/FVC in %
+ECSC = {'Male': {'fev1': (4.30, -0.029, -2.49, 0.51),
+                 'fvc': (5.76, -0.026, -4.34, 0.61),
+                 'fev1_fvc': (0.0, -0.18, 87.21, 7.17)},
+        'Female': {'fev1': (3.95, -0.025, -2.60, 0.38),
+                   'fvc': (4.43, -0.026, -2.89, 0.43),
+                   'fev1_fvc': (0.0, -0.19, 89.10, 6.51)}}
+# The equations apply from 18 to 70 - ages 18 to 25 use 25
+ECSC_AGES = (18, 70, 25)
+
+def input_columns() -> list:
+    """
+    (name, column) for the values the metrics are computed from
+    """
+    s = db.Spirometry.__table__
+    pt = db.Patient.__table__
+    ph = db.Physiology.__table__
+    return [('spiro_id', s.c.id), ('subject_id', s.c.subject_id), ('study_date', s.c.study_date), \
+            ('fev1', s.c.fev1_pre), ('fvc', s.c.fvc_pre), ('fev1_post', s.c.fev1_post), \
+            ('fvc_post', s.c.fvc_post), ('dob', pt.c.dob), ('sex', pt.c.sex), \
+            ('height', ph.c.height), ('weight', ph.c.weight)]
+
+def input_query(cols: list, after: int, limit: int, full: bool = False):
+    """
+    The next limit studies to compute with ids greater than after - all
+    studies if full, otherwise only those without a derived row
+    """
+    s = db.Spirometry.__table__
+    pt = db.Patient.__table__
+    ph = db.Physiology.__table__
+    d = db.Derived.__table__
+    query = select(*[c.label(name) for name, c in cols]) \
+        .select_from(s.join(pt, pt.c.id == s.c.subject_id)
+                     .outerjoin(ph, and_(ph.c.subject_id == s.c.subject_id, \
+                                         ph.c.study_date == s.c.study_date)))
+    if not full:
+        query = query.where(~select(d.c.id).where(d.c.spiro_id == s.c.id).exists())
+    return query.where(s.c.id > after).order_by(s.c.id).limit(limit)
+
+def reference_z(measured: np.ndarray, height: np.ndarray, age: np.ndarray, \
+                sex: np.ndarray, test: str) -> np.ndarray:
+    """
+    z-scores against the ECSC equations for test ('fev1', 'fvc' or
+    'fev1_fvc'). NaN where sex isn't known or age is outside the range
+    """
+    z = np.full(measured.shape, np.nan)
+    low, high, floor = ECSC_AGES
+    ok = (age >= low) & (age <= high)
+    a = np.maximum(age, floor)
+    for s, eqs in ECSC.items():
+        h, k, c, rsd = eqs[test]
+        sel = ok & (sex == s)
+        z[sel] = (measured[sel] - (h * height[sel] + k * a[sel] + c)) / rsd
+    return z
+
+def compute(cols: dict) -> dict:
+    """
+    Takes arrays of input_columns() values and returns arrays of derived values,
+    NaN where an input is missing
+    """
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        diff = cols['study_date'] - cols['dob']
+        age = np.where(np.isnat(diff), np.nan, diff.astype('float64')) / 365.25
+        height = cols['height'] / 100.0
+        bmi = cols['weight'] / (height * height)
+        ratio = 100.0 * cols['fev1'] / cols['fvc']
+        ratio_post = 100.0 * cols['fev1_post'] / cols['fvc_post']
+        sex = np.char.capitalize(np.char.lower(cols['sex']))
+        return {'age': age,
+                'bmi': bmi,
+                'fev1_fvc': ratio,
+                'fev1_fvc_post': ratio_post,
+                'fev1_z': reference_z(cols['fev1'], height, age, sex, 'fev1'),
+                'fvc_z': reference_z(cols['fvc'], height, age, sex, 'fvc'),
+                'fev1_fvc_z': reference_z(ratio, height, age, sex, 'fev1_fvc')}
+
+def _rows(cols: dict, values: dict, now: dt.datetime) -> list:
+    """
+    Arrays to a list of row dicts, with NaN and inf stored as NULL
+    """
+    out = {'spiro_id': cols['spiro_id'].tolist(),
+           'subject_id': cols['subject_id'].tolist(),
+           'study_date': cols['study_date'].astype(object).tolist()}
+    for k, v in values.items():
+        out[k] = np.where(np.isfinite(v), v, None).tolist()
+    keys = list(out)
+    return [dict(zip(keys, vals), computed = now) for vals in zip(*out.values())]
+
+def refresh(engine, full: bool = False, chunk_size: int = DEFAULT_CHUNK) -> int:
+    """
+    Bring the derived table up to date - derived rows for studies that have
+    been removed are deleted and rows are added for studies that don't have
+    one. The batch writer deletes the derived row of a study it updates, so
+    changed studies are recomputed too. full recomputes everything
+    Returns the number of studies computed
+    """
+    s = db.Spirometry.__table__
+    d = db.Derived.__table__
+    cols = input_columns()
+    dtypes = [numpy_dtype(c) for _, c in cols]
+    now = dt.datetime.now()
+    n = 0
+    with engine.begin() as conn:
+        if full:
+            conn.execute(delete(d))
+        else:
+            conn.execute(delete(d).where(~select(s.c.id).where(s.c.id == d.c.spiro_id).exists()))
+        # A page of studies at a time, by id, so no cursor is open while
+        # writing and memory use is bounded
+        after = 0
+        while True:
+            rows = conn.execute(input_query(cols, after, chunk_size, full)).all()
+            if len(rows) == 0:
+                break
+            arrays = {name: to_array(v, t) for (name, _), v, t in zip(cols, zip(*rows), dtypes)}
+            conn.execute(d.insert(), _rows(arrays, compute(arrays), now))
+            n += len(rows)
+            after = rows[-1][0]
+    logging.info('Derived metrics computed for {0} studies'.format(n))
+    return n
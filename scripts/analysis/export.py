@@ -0,0 +1,198 @@
+# Export of the joined patient and lung function tables in column chunks
+
+import scripts.database.db as db
+from sqlalchemy import select, func, and_, Integer, Float, Date, String
+import numpy as np
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Only needed for parquet and arrow output
+    pa = None
+
+FORMATS = ['parquet', 'arrow', 'npz']
+DEFAULT_CHUNK = 50000
+
+# Missing integers in numpy output - pyarrow output uses nulls
+INT_MISSING = -1
+
+def export_columns() -> list:
+    """
+    (name, column) for each exported column - one row per spirometry study
+    with the patient, any lung function results and height and weight from
+    the same day
+    """
+    pt = db.Patient.__table__
+    s = db.Spirometry.__table__
+    l = db.Lungfunc.__table__
+    ph = db.Physiology.__table__
+    cols = [('rxr', pt.c.rxr), ('sex', pt.c.sex), ('dob', pt.c.dob), \
+            ('subject_id', s.c.subject_id), ('spiro_id', s.c.id), ('lungfunc_id', l.c.id)]
+    cols += [(c.name, c) for c in s.columns if not c.name in ['id', 'subject_id']]
+    cols += [(c.name, c) for c in l.columns if not c.name in ['id', 'subject_id', 'spiro_id', 'study_date']]
+    cols += [('height', ph.c.height), ('weight', ph.c.weight)]
+    return cols
+
+def export_query(cols: list):
+    pt = db.Patient.__table__
+    s = db.Spirometry.__table__
+    l = db.Lungfunc.__table__
+    ph = db.Physiology.__table__
+    # Ordered to match the (subject_id, study_date) index, so no sort is needed
+    return select(*[c.label(name) for name, c in cols]) \
+        .select_from(s.join(pt, pt.c.id == s.c.subject_id)
+                     .outerjoin(l, l.c.spiro_id == s.c.id)
+                     .outerjoin(ph, and_(ph.c.subject_id == s.c.subject_id, \
+                                         ph.c.study_date == s.c.study_date))) \
+        .order_by(s.c.subject_id, s.c.study_date)
+
+def numpy_dtype(col):
+    """
+    The numpy dtype used for a column's values
+    """
+    if isinstance(col.type, Float):
+        return np.dtype('float64')
+    if isinstance(col.type, Integer):
+        return np.dtype('int64')
+    if isinstance(col.type, Date):
+        return np.dtype('datetime64[D]')
+    if isinstance(col.type, String):
+        return np.dtype('U{0}'.format(col.type.length))
+    raise ValueError('No export type for column {0}'.format(col.name))
+
+def to_array(values: tuple, dtype: np.dtype) -> np.ndarray:
+    """
+    Column values from the database as a typed array. Missing values are NaN
+    for floats, NaT for dates, INT_MISSING for integers and '' for strings
+    """
+    if dtype.kind == 'f':
+        return np.fromiter((np.nan if v is None else v for v in values), dtype, len(values))
+    if dtype.kind == 'i':
+        return np.fromiter((INT_MISSING if v is None else v for v in values), dtype, len(values))
+    if dtype.kind == 'U':
+        return np.array(['' if v is None else v for v in values], dtype)
+    return np.array(values, dtype)
+
+def iter_chunks(conn, chunk_size: int = DEFAULT_CHUNK):
+    """
+    Generator yielding the export a chunk at a time as {name: array}
+    Rows are fetched from a streaming cursor, so at most one chunk is held in
+    memory whatever the size of the tables
+    """
+    cols = export_columns()
+    dtypes = [numpy_dtype(c) for _, c in cols]
+    res = conn.execution_options(stream_results = True, yield_per = chunk_size).execute(export_query(cols))
+    for rows in res.partitions(chunk_size):
+        values = list(zip(*rows))
+        yield {name: to_array(v, dt) for (name, _), v, dt in zip(cols, values, dtypes)}
+
+def arrow_schema():
+    types = {'f': pa.float64(), 'i': pa.int64(), 'M': pa.date32(), 'U': pa.string()}
+    return pa.schema([(name, types[numpy_dtype(c).kind]) for name, c in export_columns()])
+
+def arrow_batch(chunk: dict, schema):
+    """
+    A chunk as a pyarrow RecordBatch, with missing values as nulls
+    """
+    arrays = []
+    for field in schema:
+        a = chunk[field.name]
+        if a.dtype.kind == 'i':
+            arrays.append(pa.array(a, field.type, mask = (a == INT_MISSING)))
+        elif a.dtype.kind == 'U':
+            arrays.append(pa.array(a, field.type, mask = (a == '')))
+        else:
+            arrays.append(pa.array(a, field.type, from_pandas = True))
+    return pa.RecordBatch.from_arrays(arrays, schema = schema)
+
+def export(engine, path: str, fmt: str = 'parquet', chunk_size: int = DEFAULT_CHUNK) -> int:
+    """
+    Write the joined tables to path as fmt (one of FORMATS), a chunk at a time
+    Returns the number of rows written
+    """
+    if not fmt in FORMATS:
+        raise ValueError('Unknown export format: {0}'.format(fmt))
+    if fmt != 'npz' and pa is None:
+        raise RuntimeError('pyarrow is needed for {0} export - install it or use npz'.format(fmt))
+
+    with engine.connect() as conn:
+        if fmt == 'npz':
+            return _export_npz(conn, path, chunk_size)
+
+        schema = arrow_schema()
+        if fmt == 'parquet':
+            out = pq.ParquetWriter(path, schema)
+        else:
+            out = pa.ipc.new_file(path, schema)
+        n = 0
+        try:
+            for chunk in iter_chunks(conn, chunk_size):
+                batch = arrow_batch(chunk, schema)
+                if fmt == 'parquet':
+                    out.write_batch(batch)
+                else:
+                    out.write(batch)
+                n += batch.num_rows
+                logging.info('Exported {0} rows'.format(n))
+        finally:
+            out.close()
+        return n
+
+def _export_npz(conn, path: str, chunk_size: int) -> int:
+    """
+    An npz holds whole arrays, so each column is filled in a memory mapped
+    .npy file (sized from a count of the rows) and the files are then stored
+    uncompressed in the archive - np.load(path) reads it as usual
+    The count and the rows are separate queries, so an import running at the
+    same time can change the number of rows in between - the files are resized
+    to the rows actually read if so
+    """
+    cols = export_columns()
+    query = export_query(cols).order_by(None).subquery()
+    total = conn.execute(select(func.count()).select_from(query)).scalar()
+    tmp = tempfile.mkdtemp(prefix = 'lungdb-export-', dir = os.path.dirname(os.path.abspath(path)))
+    try:
+        files = {name: os.path.join(tmp, name + '.npy') for name, _ in cols}
+        arrays = {name: np.lib.format.open_memmap(files[name], mode = 'w+', dtype = numpy_dtype(c), \
+                                                  shape = (total,)) \
+                  for name, c in cols}
+        n = 0
+        for chunk in iter_chunks(conn, chunk_size):
+            size = len(chunk['spiro_id'])
+            if n + size > len(arrays['spiro_id']):
+                logging.info('Rows added during the export - resizing')
+                arrays = _resize(arrays, files, n, max(n + size, 2 * len(arrays['spiro_id'])))
+            for name, a in chunk.items():
+                arrays[name][n:n + size] = a
+            n += size
+            logging.info('Exported {0} rows'.format(n))
+        if n < len(arrays['spiro_id']):
+            arrays = _resize(arrays, files, n, n)
+        for a in arrays.values():
+            a.flush()
+        del arrays
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64 = True) as zf:
+            for name, _ in cols:
+                zf.write(files[name], name + '.npy')
+    finally:
+        shutil.rmtree(tmp)
+    return n
+
+def _resize(arrays: dict, files: dict, n: int, size: int) -> dict:
+    """
+    Copy the first n rows of each memory mapped column to a new file of size
+    rows - files is updated with the new paths
+    """
+    resized = dict()
+    for name, a in arrays.items():
+        files[name] = '{0}.{1}.npy'.format(files[name][:-len('.npy')], size)
+        resized[name] = np.lib.format.open_memmap(files[name], mode = 'w+', dtype = a.dtype, shape = (size,))
+        for i in range(0, n, DEFAULT_CHUNK):
+            resized[name][i:min(n, i + DEFAULT_CHUNK)] = a[i:min(n, i + DEFAULT_CHUNK)]
+    return resized
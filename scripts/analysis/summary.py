@@ -0,0 +1,205 @@
+# Cohort summary - studies per month and FEV1 % predicted by sex and age band
+
+import scripts.database.db as db
+from sqlalchemy import select, func, and_, or_
+import numpy as np
+import datetime as dt
+import logging
+
+# Age at the study: lower bound of each band after the first
+AGE_EDGES = [18, 40, 60, 75]
+AGE_BANDS = ['0-17', '18-39', '40-59', '60-74', '75+']
+SEXES = ['Male', 'Female']
+UNKNOWN = 'Unknown'
+
+# A study has full lung function if its lungfunc row has any of these - VC
+# alone can come from the spirometry section of the report
+FULL_LUNGFUNC = ['tlco', 'vasb', 'kco', 'frc', 'tlc', 'rv', 'tlcrv']
+
+def _month(year, month) -> dt.date:
+    return dt.date(int(year), int(month), 1)
+
+def _next_month(month: dt.date) -> dt.date:
+    return (month.replace(day = 28) + dt.timedelta(days = 4)).replace(day = 1)
+
+def _missing_months(conn) -> list:
+    """
+    Months with studies but no summaries: new months, and those whose studies
+    the batch writer or manifest have added, changed or removed (they delete
+    the month's summaries). Each month is looked up through the study date
+    index, so the study table isn't read
+    """
+    s = db.Spirometry.__table__
+    c = db.CohortSummary.__table__
+    first, last = conn.execute(select(func.min(s.c.study_date), func.max(s.c.study_date))).first()
+    if first is None:
+        return []
+    stored = set(conn.execute(select(c.c.month).distinct()).scalars())
+    missing = []
+    month = first.replace(day = 1)
+    while month <= last:
+        end = _next_month(month)
+        if not month in stored and \
+                conn.execute(select(s.c.id).where(and_(s.c.study_date >= month, s.c.study_date < end)) \
+                             .limit(1)).first() is not None:
+            missing.append(month)
+        month = end
+    return missing
+
+def _runs(months: list) -> list:
+    """
+    Sorted months as [(start, end)] spans of consecutive months
+    """
+    runs = []
+    for month in months:
+        if len(runs) > 0 and runs[-1][1] == month:
+            runs[-1] = (runs[-1][0], _next_month(month))
+        else:
+            runs.append((month, _next_month(month)))
+    return runs
+
+def _load(conn, start: dt.date, end: dt.date) -> dict:
+    """
+    Every study from start up to (not including) end as arrays
+    """
+    s = db.Spirometry.__table__
+    l = db.Lungfunc.__table__
+    pt = db.Patient.__table__
+    full_lf = or_(*[l.c[c].isnot(None) for c in FULL_LUNGFUNC])
+    res = conn.execute(select(s.c.id, s.c.study_date, s.c.fev1_pre_percent_pred, full_lf, pt.c.sex, pt.c.dob)
+                       .select_from(s.join(pt, pt.c.id == s.c.subject_id)
+                                    .outerjoin(l, l.c.spiro_id == s.c.id))
+                       .where(and_(s.c.study_date >= start, s.c.study_date < end)))
+    rows = res.all()
+    if len(rows) == 0:
+        return None
+    ids, dates, fev1_pp, full, sexes, dobs = zip(*rows)
+    return {'id': np.array(ids, 'int64'),
+            'study_date': np.array(dates, 'datetime64[D]'),
+            'fev1_pp': np.fromiter((np.nan if v is None else v for v in fev1_pp), 'float64', len(rows)),
+            'lungfunc': np.array([bool(v) for v in full]),
+            'sex': np.array(['' if v is None else v for v in sexes]),
+            'dob': np.array(dobs, 'datetime64[D]')}
+
+def groups(cols: dict):
+    """
+    Month, sex and age band of each study as arrays of indexes into the
+    studies' months, SEXES + [UNKNOWN] and AGE_BANDS + [UNKNOWN]
+    """
+    months = cols['study_date'].astype('datetime64[M]')
+    sex = np.char.capitalize(np.char.lower(cols['sex']))
+    sex_i = np.full(len(sex), len(SEXES))
+    for i, s in enumerate(SEXES):
+        sex_i[sex == s] = i
+    diff = cols['study_date'] - cols['dob']
+    age = np.where(np.isnat(diff), np.nan, diff.astype('float64')) / 365.25
+    with np.errstate(invalid = 'ignore'):
+        band_i = np.where(np.isnan(age) | (age < 0), len(AGE_BANDS), np.digitize(age, AGE_EDGES))
+    return months, sex_i, band_i
+
+def summarise(cols: dict) -> list:
+    """
+    Takes _load() arrays and returns a row per month, sex and age band:
+    number of studies, how many had full lung function, and the count and
+    median of FEV1 % predicted
+    """
+    months, sex_i, band_i = groups(cols)
+    n_sex = len(SEXES) + 1
+    n_band = len(AGE_BANDS) + 1
+    key = (months.astype('int64') * n_sex + sex_i) * n_band + band_i
+    keys, g = np.unique(key, return_inverse = True)
+    studies = np.bincount(g)
+    with_lf = np.bincount(g, cols['lungfunc']).astype('int64')
+    last_id = np.zeros(len(keys), 'int64')
+    np.maximum.at(last_id, g, cols['id'])
+
+    # Medians - sort the known values by group then value, so each group's
+    # values are a contiguous sorted run
+    ok = ~np.isnan(cols['fev1_pp'])
+    order = np.lexsort((cols['fev1_pp'][ok], g[ok]))
+    values = cols['fev1_pp'][ok][order]
+    pp_n = np.bincount(g[ok], minlength = len(keys))
+    starts = np.cumsum(pp_n) - pp_n
+    lo = starts + np.maximum(pp_n - 1, 0) // 2
+    hi = starts + pp_n // 2
+    if len(values) > 0:
+        median = np.where(pp_n > 0, (values[np.minimum(lo, len(values) - 1)] + \
+                                     values[np.minimum(hi, len(values) - 1)]) / 2, np.nan)
+    else:
+        median = np.full(len(keys), np.nan)
+
+    now = dt.datetime.now()
+    rows = []
+    for i, k in enumerate(keys.tolist()):
+        month, rest = divmod(k, n_sex * n_band)
+        s, b = divmod(rest, n_band)
+        rows.append({'month': np.datetime64(month, 'M').astype('datetime64[D]').astype(object),
+                     'sex': (SEXES + [UNKNOWN])[s],
+                     'age_band': (AGE_BANDS + [UNKNOWN])[b],
+                     'studies': int(studies[i]),
+                     'with_lungfunc': int(with_lf[i]),
+                     'fev1_pp_n': int(pp_n[i]),
+                     'fev1_pp_median': (float(median[i]) if np.isfinite(median[i]) else None),
+                     'last_id': int(last_id[i]),
+                     'computed': now})
+    return rows
+
+def refresh(engine, full: bool = False) -> int:
+    """
+    Bring the cohort summaries up to date. Only months without summaries are
+    computed - the batch writer and manifest delete the summaries of months
+    whose studies they add, change or remove. full recomputes every month
+    Returns the number of months computed
+    """
+    c = db.CohortSummary.__table__
+    with engine.begin() as conn:
+        if full:
+            conn.execute(c.delete())
+        stale = _missing_months(conn)
+        if len(stale) == 0:
+            logging.info('Cohort summary: no months to compute')
+            return 0
+
+        # Each span of consecutive months is read in one query through the
+        # study date index - usually just the latest few months
+        rows = []
+        for start, end in _runs(stale):
+            cols = _load(conn, start, end)
+            if cols is not None:
+                rows += summarise(cols)
+        if len(rows) > 0:
+            conn.execute(c.insert(), rows)
+    logging.info('Cohort summary: {0} months computed'.format(len(stale)))
+    return len(stale)
+
+def _period(query, col, start: dt.date, end: dt.date):
+    if start is not None:
+        query = query.where(col >= start.replace(day = 1))
+    if end is not None:
+        query = query.where(col <= end.replace(day = 1))
+    return query.order_by(col)
+
+def studies_per_month(engine, start: dt.date = None, end: dt.date = None) -> list:
+    """
+    [(month, studies, studies with full lung function, spirometry only)] for
+    the months from start to end (inclusive, either may be None), answered
+    from the summaries
+    """
+    c = db.CohortSummary.__table__
+    query = _period(select(c.c.month, func.sum(c.c.studies), func.sum(c.c.with_lungfunc)) \
+                    .group_by(c.c.month), c.c.month, start, end)
+    with engine.connect() as conn:
+        return [(month, int(n), int(n_lf), int(n) - int(n_lf)) for month, n, n_lf in conn.execute(query)]
+
+def fev1_pp_medians(engine, start: dt.date = None, end: dt.date = None) -> list:
+    """
+    [(month, sex, age band, number of studies with FEV1 % predicted, median)]
+    for the months from start to end, answered from the summaries. The median
+    is None where a group has no values
+    """
+    c = db.CohortSummary.__table__
+    query = _period(select(c.c.month, c.c.sex, c.c.age_band, c.c.fev1_pp_n, c.c.fev1_pp_median), \
+                    c.c.month, start, end) \
+        .order_by(c.c.sex, c.c.age_band)
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(query)]
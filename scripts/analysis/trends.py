@@ -0,0 +1,143 @@
+# Longitudinal trends - per patient rate of change of lung function
+
+import scripts.database.db as db
+from sqlalchemy import select, func, and_
+import numpy as np
+import datetime as dt
+import logging
+
+# Measures with a trend: name - (model, column)
+TREND_SOURCES = {'fev1': (db.Spirometry, 'fev1_pre'),
+                 'fvc': (db.Spirometry, 'fvc_pre'),
+                 'tlco': (db.Lungfunc, 'tlco')}
+
+# Most patients' trends deleted, or results loaded, in one statement
+DELETE_SIZE = 500
+
+def grouped_regression(groups: np.ndarray, t: np.ndarray, y: np.ndarray) -> dict:
+    """
+    Least squares line of y against t for every group at once
+    groups must be sorted. Returns arrays, one entry per group in order:
+        group, n, first and last t, slope, intercept (the fitted value at the
+        first t) and resid_sd (residual standard deviation)
+    slope is NaN for a group without two distinct t, resid_sd for fewer than
+    three points
+    """
+    keys, starts, g = np.unique(groups, return_index = True, return_inverse = True)
+    n = np.bincount(g)
+    t_mean = np.bincount(g, t) / n
+    y_mean = np.bincount(g, y) / n
+    dt_ = t - t_mean[g]
+    dy = y - y_mean[g]
+    stt = np.bincount(g, dt_ * dt_)
+    sty = np.bincount(g, dt_ * dy)
+    syy = np.bincount(g, dy * dy)
+    t_first = np.minimum.reduceat(t, starts)
+    t_last = np.maximum.reduceat(t, starts)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        slope = np.where(stt > 0, sty / stt, np.nan)
+        sse = np.maximum(syy - slope * sty, 0.0)
+        resid_sd = np.where(n > 2, np.sqrt(sse / (n - 2)), np.nan)
+    return {'group': keys,
+            'n': n,
+            'first': t_first,
+            'last': t_last,
+            'slope': slope,
+            'intercept': y_mean + slope * (t_first - t_mean),
+            'resid_sd': resid_sd}
+
+def _signatures(conn, measure: str) -> dict:
+    """
+    {subject_id: (number of results, highest study id)} - a patient's trend
+    needs recomputing when this changes
+    """
+    model, column = TREND_SOURCES[measure]
+    t = model.__table__
+    res = conn.execute(select(t.c.subject_id, func.count(), func.max(t.c.id))
+                       .where(and_(t.c[column].isnot(None), t.c.study_date.isnot(None)))
+                       .group_by(t.c.subject_id))
+    return {sid: (n, last) for sid, n, last in res}
+
+def _load(conn, measure: str, subjects: list = None):
+    """
+    Results for measure as arrays of subject id, years since 1970 and value,
+    sorted by subject - for the patients in subjects, or everyone if None
+    """
+    model, column = TREND_SOURCES[measure]
+    t = model.__table__
+    query = select(t.c.subject_id, t.c.study_date, t.c[column]) \
+        .where(and_(t.c[column].isnot(None), t.c.study_date.isnot(None))) \
+        .order_by(t.c.subject_id, t.c.study_date)
+    if subjects is None:
+        rows = conn.execute(query).all()
+    else:
+        subjects = sorted(subjects)
+        rows = []
+        for i in range(0, len(subjects), DELETE_SIZE):
+            rows += conn.execute(query.where(t.c.subject_id.in_(subjects[i:i + DELETE_SIZE]))).all()
+    if len(rows) == 0:
+        return (np.zeros(0, 'int64'), np.zeros(0), np.zeros(0))
+    sids, dates, values = zip(*rows)
+    days = np.array(dates, 'datetime64[D]').astype('float64')
+    return (np.array(sids, 'int64'), days / 365.25, np.array(values, 'float64'))
+
+def _date(years: float) -> dt.date:
+    return (np.datetime64(int(round(years * 365.25)), 'D')).astype(object)
+
+def refresh_measure(conn, measure: str, full: bool = False) -> int:
+    tr = db.Trend.__table__
+    current = _signatures(conn, measure)
+    stored = dict()
+    if not full:
+        res = conn.execute(select(tr.c.subject_id, tr.c.n, tr.c.last_id).where(tr.c.measure == measure))
+        stored = {sid: (n, last) for sid, n, last in res}
+    stale = [sid for sid, sig in current.items() if stored.get(sid) != sig]
+    gone = [sid for sid in stored if not sid in current]
+
+    if full:
+        conn.execute(tr.delete().where(tr.c.measure == measure))
+    else:
+        todo = sorted(stale + gone)
+        for i in range(0, len(todo), DELETE_SIZE):
+            conn.execute(tr.delete().where(and_(tr.c.measure == measure, \
+                                                tr.c.subject_id.in_(todo[i:i + DELETE_SIZE]))))
+    if len(stale) == 0:
+        return 0
+
+    sids, years, values = _load(conn, measure, (None if full else stale))
+    fit = grouped_regression(sids, years, values)
+
+    now = dt.datetime.now()
+    rows = []
+    for i, sid in enumerate(fit['group'].tolist()):
+        rows.append({'subject_id': sid,
+                     'measure': measure,
+                     'n': int(fit['n'][i]),
+                     'last_id': current[sid][1],
+                     'first_date': _date(fit['first'][i]),
+                     'last_date': _date(fit['last'][i]),
+                     'slope': (float(fit['slope'][i]) if np.isfinite(fit['slope'][i]) else None),
+                     'intercept': (float(fit['intercept'][i]) if np.isfinite(fit['intercept'][i]) else None),
+                     'resid_sd': (float(fit['resid_sd'][i]) if np.isfinite(fit['resid_sd'][i]) else None),
+                     'computed': now})
+    conn.execute(tr.insert(), rows)
+    return len(rows)
+
+def refresh(engine, full: bool = False) -> int:
+    """
+    Bring the trend table up to date - one row per patient per measure with
+    the slope (change per year), the fitted value at the first study and the
+    variability about the line
+    Only patients with new or removed results are refitted, or whose results
+    were changed by the batch writer (which deletes their trends). full
+    refits everyone
+    Returns the number of trends computed
+    """
+    n = 0
+    with engine.begin() as conn:
+        for measure in TREND_SOURCES:
+            done = refresh_measure(conn, measure, full)
+            logging.info('Trends: {0} {1} refitted'.format(done, measure))
+            n += done
+    return n
@@ -0,0 +1,34 @@
+# Look for patients recorded more than once under different RXRs or details
+import sys
+import os
+folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, folder)
+
+import argparse
+import logging
+
+from scripts.database.engine import Database, DB_URL_ENV, DEFAULT_DB_URL
+import scripts.database.reconcile as reconcile
+
+logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO, \
+                    filename='./logs/lungdb.log')
+
+def main():
+    ap = argparse.ArgumentParser(description='Find probable duplicate patients and flag them in the patient_flag table')
+    ap.add_argument('--db', default=None, metavar='URL', \
+                    help='Database url (default ${0} or {1})'.format(DB_URL_ENV, DEFAULT_DB_URL))
+    ap.add_argument('--max-block', type=int, default=reconcile.MAX_BLOCK, \
+                    help='Largest group of similar patients compared pair by pair')
+    ap.add_argument('--dry-run', action='store_true', help='List the duplicates without saving flags')
+    args = ap.parse_args()
+
+    engine = Database(args.db).engine
+    pairs = reconcile.audit(engine, args.max_block, not args.dry_run)
+    for a, b, reasons in pairs:
+        print('{0} {1} {2} {3}  /  {4} {5} {6} {7}\n    {8}'.format( \
+            a['rxr'], a['fname'], a['lname'], a['dob'], b['rxr'], b['fname'], b['lname'], b['dob'], \
+            ', '.join(reasons)))
+    print('{0} probable duplicates'.format(len(pairs)))
+
+if __name__ == '__main__':
+    main()
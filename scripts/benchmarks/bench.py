@@ -0,0 +1,200 @@
+# Throughput benchmarks for parsing, database writes and full scans
+import sys
+import os
+folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, folder)
+
+from pathlib import Path
+import argparse
+import json
+import logging
+import shutil
+import subprocess
+import tempfile
+import time
+from sqlalchemy import create_engine
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows - peak memory isn't reported
+    resource = None
+
+import scripts.database.db as db
+from scripts.benchmarks.corpus import reports, write_corpus
+from scripts.database.writer import BatchWriter
+from scripts.parsers.parsers import Parsetype, PARSERS
+from scripts.parsers.textcache import TextCache, file_hash, DEFAULT_CACHE_MB
+import scripts.parsers.textextract as textextract
+
+SCANPFTS = os.path.join(folder, 'scripts', 'scanpfts.py')
+
+def peak_rss_mb(who = None) -> float:
+    """
+    Peak resident memory of this process in MB, or of waited for child
+    processes if who is resource.RUSAGE_CHILDREN
+    """
+    if resource is None:
+        return None
+    if who is None:
+        who = resource.RUSAGE_SELF
+    kb = resource.getrusage(who).ru_maxrss
+    # Reported in bytes on macOS, kB elsewhere
+    return (kb / (1024 * 1024) if sys.platform == 'darwin' else kb / 1024)
+
+def result(name: str, docs: int, seconds: float, rss: float) -> dict:
+    return {'name': name,
+            'docs': docs,
+            'seconds': round(seconds, 3),
+            'docs_per_sec': round(docs / seconds, 1) if seconds > 0 else None,
+            'peak_rss_mb': round(rss, 1) if rss is not None else None}
+
+def bench_parsers(n: int, seed: int = 0) -> list:
+    """
+    Field extraction for each parser from report text already in memory, so
+    pdf text extraction isn't included
+    """
+    out = []
+    for p, cls in PARSERS.items():
+        texts = [t for _, t in reports(n, {p: 1.0}, seed)]
+        f = Path('synthetic.pdf')
+        start = time.perf_counter()
+        for t in texts:
+            if not cls(f, text = t).is_ok():
+                raise RuntimeError('Synthetic {0} report failed to parse'.format(p.name))
+        out.append(result('parse {0}'.format(p.name), n, time.perf_counter() - start, peak_rss_mb()))
+    return out
+
+def bench_db(n: int, work: Path, batch_size: int = 500, seed: int = 0) -> list:
+    """
+    Rate records are added to an empty database through the batch writer, as
+    add_to_db() does
+    """
+    recs = []
+    for p, t in reports(n, seed = seed):
+        recs.append((PARSERS[p](Path('synthetic.pdf'), text = t).get_data(), p))
+
+    engine = create_engine('sqlite:///{0}'.format((work / 'bench.db').as_posix()))
+    db.Base.metadata.create_all(engine)
+    writer = BatchWriter(engine, batch_size = batch_size, max_seconds = float('inf'))
+    writer.load_patients()
+    start = time.perf_counter()
+    for rec, p in recs:
+        writer.add(rec, p)
+    writer.flush()
+    secs = time.perf_counter() - start
+    engine.dispose()
+    return [result('add_to_db batch {0}'.format(batch_size), n, secs, peak_rss_mb())]
+
+def prime_cache(data: Path, cache_dir: Path, backend: str):
+    """
+    Put each file's own contents in the text cache as its extracted text, so
+    a scan of a plain text corpus runs with every extraction a cache hit
+    """
+    cache = TextCache(str(cache_dir), DEFAULT_CACHE_MB * 1024 * 1024)
+    for f in data.rglob('*.pdf'):
+        cache.put(file_hash(f), backend, f.read_text())
+
+def bench_scan(n: int, work: Path, workers: int = 1, pdf: bool = False, seed: int = 0) -> list:
+    """
+    A full scan of n reports by scanpfts.py in a fresh directory, timed from
+    the outside so start up and every stage of the pipeline are included
+    With pdf the reports are real pdfs read with pdfminer, otherwise the text
+    cache is primed so extraction is a cache lookup - Tika needs Java and
+    would dominate the timings anyway
+    """
+    run = work / 'scan{0}'.format(n)
+    (run / 'logs').mkdir(parents = True)
+    write_corpus(run / 'data', n, pdf, seed = seed)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = folder
+    env['LUNGDB_TEXT_CACHE'] = str(run / 'logs' / 'textcache')
+    if pdf:
+        env[textextract.EXTRACTOR_ENV] = 'pdfminer'
+        env['LUNGDB_TEXT_CACHE'] = ''
+    else:
+        env[textextract.EXTRACTOR_ENV] = textextract.DEFAULT_EXTRACTOR
+        prime_cache(run / 'data', run / 'logs' / 'textcache', textextract.DEFAULT_EXTRACTOR)
+
+    engine = create_engine('sqlite:///{0}'.format((run / 'logs' / 'pfts.db').as_posix()))
+    db.Base.metadata.create_all(engine)
+    engine.dispose()
+
+    start = time.perf_counter()
+    ret = subprocess.call([sys.executable, SCANPFTS, '--workers', str(workers), \
+                           '--batch-size', '5000'], cwd = str(run), env = env)
+    secs = time.perf_counter() - start
+    if ret != 0:
+        raise RuntimeError('scanpfts.py exited with {0}'.format(ret))
+    shutil.rmtree(run)
+    # The largest of any child so far - scans are run smallest first
+    rss = peak_rss_mb(resource.RUSAGE_CHILDREN if resource is not None else None)
+    return [result('read_dir {0} workers {1}{2}'.format(n, workers, ' pdf' if pdf else ''), n, secs, rss)]
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """
+    Returns the names of benchmarks more than tolerance (a fraction) slower
+    than in baseline
+    """
+    base = {r['name']: r for r in baseline}
+    slower = []
+    for r in results:
+        b = base.get(r['name'])
+        if b is not None and b['docs_per_sec'] and r['docs_per_sec'] is not None and \
+                r['docs_per_sec'] < b['docs_per_sec'] * (1 - tolerance):
+            slower.append(r['name'])
+    return slower
+
+def main():
+    args = get_args()
+    # Parser warnings (e.g. no lung volumes in a spirometry only report) would
+    # otherwise be timed along with the parsing
+    logging.basicConfig(level = logging.ERROR)
+    results = []
+    with tempfile.TemporaryDirectory(prefix = 'lungdb-bench-') as tmp:
+        work = Path(tmp)
+        if 'parse' in args.only:
+            results += bench_parsers(args.parse_docs, args.seed)
+        if 'db' in args.only:
+            results += bench_db(args.db_docs, work, args.batch_size, args.seed)
+        if 'scan' in args.only:
+            for n in args.sizes:
+                results += bench_scan(n, work, args.workers, args.pdf, args.seed)
+
+    for r in results:
+        print('{0:<36}{1:>8} docs{2:>10.2f} s{3:>12} docs/s{4:>10} MB'.format(r['name'], r['docs'], \
+              r['seconds'], str(r['docs_per_sec']), str(r['peak_rss_mb'])))
+    if args.json is not None:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent = 2)
+    if args.compare is not None:
+        with open(args.compare) as fh:
+            slower = compare(results, json.load(fh), args.tolerance)
+        for name in slower:
+            print('Slower than baseline: {0}'.format(name))
+        if len(slower) > 0:
+            sys.exit(1)
+
+def get_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description='Benchmark parsing and database throughput on synthetic reports')
+    ap.add_argument('--only', action='append', choices=['parse', 'db', 'scan'], default=None, \
+                    help='Benchmarks to run (default all, may be repeated)')
+    ap.add_argument('--parse-docs', type=int, default=5000, help='Reports per parser')
+    ap.add_argument('--db-docs', type=int, default=20000, help='Records written by the database benchmark')
+    ap.add_argument('--batch-size', type=int, default=500, help='Batch writer chunk size')
+    ap.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')], default=[1000, 10000, 100000], \
+                    help='Comma separated corpus sizes for the full scan (default 1000,10000,100000)')
+    ap.add_argument('--workers', type=int, default=1, help='Parse workers for the full scan')
+    ap.add_argument('--pdf', action='store_true', help='Scan real pdfs with pdfminer rather than cached text')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--json', default=None, help='Write results to this file')
+    ap.add_argument('--compare', default=None, help='Results file from an earlier run - exit 1 if slower')
+    ap.add_argument('--tolerance', type=float, default=0.2, \
+                    help='Fraction slower than the baseline allowed by --compare (default 0.2)')
+    args = ap.parse_args()
+    if args.only is None:
+        args.only = ['parse', 'db', 'scan']
+    return args
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# Synthetic report generator for benchmarking - no real patient data
+import sys
+import os
+folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, folder)
+
+from pathlib import Path
+import argparse
+import random
+import re
+
+from scripts.parsers.parsers import Parsetype
+
+FIRST_NAMES = ['John', 'Mary', 'Peter', 'Susan', 'David', 'Helen', 'James', 'Linda', 'Paul', 'Karen']
+LAST_NAMES = ['Smith', 'Jones', 'Taylor', 'Brown', 'Wilson', 'Evans', 'Thomas', 'Roberts', 'Walker', 'Wright']
+
+# Proportion of each report type in a mixed corpus
+DEFAULT_MIX = {Parsetype.PT_FULL_PFT: 0.7,
+               Parsetype.PT_NEW_OXI: 0.1,
+               Parsetype.PT_OLD_OXI: 0.1,
+               Parsetype.PT_RAD8: 0.1}
+
+class Patient:
+    def __init__(self, rng: random.Random, n: int):
+        self.rxr = 'RXR{0:07d}'.format(n)
+        self.fname = rng.choice(FIRST_NAMES)
+        self.lname = rng.choice(LAST_NAMES)
+        self.dob = '{0:02d}/{1:02d}/{2}'.format(rng.randint(1, 28), rng.randint(1, 12), rng.randint(1930, 2000))
+        self.sex = rng.choice(['Male', 'Female'])
+
+def study_date(rng: random.Random) -> str:
+    return '{0:02d}/{1:02d}/{2}'.format(rng.randint(1, 28), rng.randint(1, 12), rng.randint(2010, 2020))
+
+def _row(label: str, vals: list) -> str:
+    return '{0:<8}{1}'.format(label, '  '.join('{0:>6}'.format(v) for v in vals))
+
+def _measure(rng: random.Random, pred: float, sr: bool = True) -> list:
+    meas = pred * rng.uniform(0.5, 1.2)
+    vals = ['{0:.2f}'.format(pred), '{0:.2f}'.format(meas), '{0:.0f}'.format(100 * meas / pred)]
+    if sr:
+        vals.append('{0:.2f}'.format(rng.uniform(-3, 2)))
+    return vals
+
+def _spiro(rng: random.Random, pred: float) -> list:
+    pre = pred * rng.uniform(0.5, 1.2)
+    post = pre * rng.uniform(0.95, 1.2)
+    return ['{0:.2f}'.format(pred), '{0:.2f}'.format(pre), '{0:.0f}'.format(100 * pre / pred),
+            '{0:.2f}'.format(post), '{0:.0f}'.format(100 * post / pred),
+            '{0:.1f}'.format(100 * (post - pre) / pre),
+            '{0:.2f}'.format(rng.uniform(-3, 2)), '{0:.2f}'.format(rng.uniform(-3, 2))]
+
+def pft_text(rng: random.Random, pt: Patient) -> str:
+    """
+    A full PFT report in the layout PFTParse expects
+    About a fifth are spirometry only
+    """
+    lines = ['Lung Function Laboratory', '',
+             'Last Name: {0}            First Name: {1}'.format(pt.lname.upper(), pt.fname.upper()),
+             'Patient ID: {0}      Birth Date: {1}'.format(pt.rxr, pt.dob),
+             'Gender: {0}     Height: {1:.1f} cm    Weight: {2:.1f} kg'.format(pt.sex, rng.uniform(150, 195), \
+                                                                         rng.uniform(45, 130)),
+             'Study Date: {0}'.format(study_date(rng)), '',
+             '        Pred     Pre    %Pred   Post   %Pred  %Chg   SR pre  SR post',
+             _row('FEV1', _spiro(rng, rng.uniform(2, 4))),
+             _row('FVC', _spiro(rng, rng.uniform(3, 5))),
+             _row('FEV1/FVC', ['{0:.0f}'.format(rng.uniform(60, 85)), '{0:.0f}'.format(rng.uniform(40, 85))]),
+             '']
+    if rng.random() < 0.8:
+        lines += ['        Pred    Meas    %Pred   SR',
+                  _row('TLco', _measure(rng, rng.uniform(6, 10))),
+                  _row('VAsb', _measure(rng, rng.uniform(4, 7), False)),
+                  _row('KCO', _measure(rng, rng.uniform(1, 2), False)),
+                  _row('FRC', _measure(rng, rng.uniform(2, 4))),
+                  _row('VC', _measure(rng, rng.uniform(3, 5))),
+                  _row('TLC', _measure(rng, rng.uniform(5, 7))),
+                  _row('RV', _measure(rng, rng.uniform(1.5, 2.5))),
+                  _row('RV/TLC', _measure(rng, rng.uniform(30, 40)))]
+    return '\n'.join(lines) + '\n'
+
+def newoxi_text(rng: random.Random, pt: Patient) -> str:
+    return '\n'.join(['Overnight Oximetry Report',
+                      'Patient Name: {0}, {1}'.format(pt.lname.upper(), pt.fname.upper()),
+                      'Index Number: {0}'.format(pt.rxr),
+                      'Date of Birth: {0}'.format(pt.dob),
+                      'Date of Study: {0}'.format(study_date(rng)), '',
+                      'Dips/Hr: {0:.1f}'.format(rng.uniform(0, 60)),
+                      'Rises/Hr: {0:.1f}'.format(rng.uniform(0, 60))]) + '\n'
+
+def oldoxi_text(rng: random.Random, pt: Patient) -> str:
+    return '\n'.join(['Oximetry Summary',
+                      'Patient Name: {0}, {1}'.format(pt.lname, pt.fname),
+                      'Index Number: {0}'.format(pt.rxr.lower()),
+                      'Date of Study: {0}'.format(study_date(rng)),
+                      'Date of Birth: {0}'.format(pt.dob),
+                      'Average Dips/Hour: {0:.1f}  (>=4%)'.format(rng.uniform(0, 60)),
+                      'Rises/Hr: {0:.1f}  (>6bpm)'.format(rng.uniform(0, 60))]) + '\n'
+
+def rad8_text(rng: random.Random, pt: Patient) -> str:
+    return '\n'.join(['Rad-8 overnight oximetry',
+                      'Name: {0} {1}'.format(pt.fname, pt.lname),
+                      'Hospital number: {0}'.format(pt.rxr),
+                      'Date of birth: {0}'.format(pt.dob),
+                      'Recording date: {0}'.format(study_date(rng)), '',
+                      'ODI {0:.1f}'.format(rng.uniform(0, 60)),
+                      'HRI {0:.1f}'.format(rng.uniform(0, 60)), '',
+                      'Notes:', 'Synthetic study.', '',
+                      'Report:', 'No significant desaturation.', '',
+                      'Summary', '']) + '\n'
+
+GENERATORS = {Parsetype.PT_FULL_PFT: pft_text,
+              Parsetype.PT_NEW_OXI: newoxi_text,
+              Parsetype.PT_OLD_OXI: oldoxi_text,
+              Parsetype.PT_RAD8: rad8_text}
+
+def reports(n: int, mix: dict = DEFAULT_MIX, seed: int = 0, patients: int = None):
+    """
+    Generator yielding n (report type, text) pairs
+    Reports are spread over patients patients (default n / 5) so, as in the
+    real archive, most patients have several studies
+    The same seed always gives the same corpus
+    """
+    rng = random.Random(seed)
+    if patients is None:
+        patients = max(1, n // 5)
+    pts = dict()
+    types = list(mix)
+    weights = [mix[t] for t in types]
+    for _ in range(n):
+        k = rng.randrange(patients)
+        if not k in pts:
+            pts[k] = Patient(rng, 1000000 + k)
+        p = rng.choices(types, weights)[0]
+        yield (p, GENERATORS[p](rng, pts[k]))
+
+def _pdf_string(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def make_pdf(text: str) -> bytes:
+    """
+    A minimal single page pdf showing text in Helvetica, one line per text
+    line with the columns of tables placed by character position
+    """
+    ops = ['BT', '/F1 9 Tf']
+    y = 800
+    for line in text.split('\n'):
+        for cell in re.finditer(r'\S+(?: \S+)*', line):
+            ops.append('1 0 0 1 {0:.1f} {1} Tm ({2}) Tj'.format(40 + cell.start() * 5.5, y, \
+                                                                _pdf_string(cell.group(0))))
+        y -= 12
+    ops.append('ET')
+    stream = '\n'.join(ops).encode('latin-1')
+
+    objs = [b'<< /Type /Catalog /Pages 2 0 R >>',
+            b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R '
+            b'/Resources << /Font << /F1 5 0 R >> >> >>',
+            b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream',
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += str(i + 1).encode() + b' 0 obj\n' + obj + b'\nendobj\n'
+    xref = len(out)
+    out += 'xref\n0 {0}\n0000000000 65535 f \n'.format(len(objs) + 1).encode()
+    out += b''.join('{0:010d} 00000 n \n'.format(o).encode() for o in offsets)
+    out += 'trailer\n<< /Size {0} /Root 1 0 R >>\nstartxref\n{1}\n%%EOF\n'.format(len(objs) + 1, xref).encode()
+    return out
+
+def write_corpus(out: Path, n: int, pdf: bool = False, mix: dict = DEFAULT_MIX, seed: int = 0, \
+                 per_dir: int = 1000):
+    """
+    Write n synthetic reports under out, per_dir files to a subdirectory
+    With pdf each report is a real pdf, otherwise the .pdf file holds the
+    report text directly (bench.py's prime_cache() puts it in the text cache
+    as the file's extracted text)
+    """
+    for i, (p, text) in enumerate(reports(n, mix, seed)):
+        d = out / '{0:04d}'.format(i // per_dir)
+        if i % per_dir == 0:
+            d.mkdir(parents = True, exist_ok = True)
+        f = d / '{0:07d}_{1}.pdf'.format(i, p.name)
+        if pdf:
+            f.write_bytes(make_pdf(text))
+        else:
+            f.write_text(text)
+
+def main():
+    ap = argparse.ArgumentParser(description='Write a corpus of synthetic reports')
+    ap.add_argument('out', help='Directory to write to')
+    ap.add_argument('-n', type=int, default=1000, help='Number of reports')
+    ap.add_argument('--pdf', action='store_true', help='Write real pdfs rather than plain text')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+    write_corpus(Path(args.out), args.n, args.pdf, seed = args.seed)
+
+if __name__ == '__main__':
+    main()
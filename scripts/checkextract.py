@@ -0,0 +1,56 @@
+# Compare the results of parsing PFT reports with each text extraction backend
+import sys
+import os
+folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, folder)
+
+from pathlib import Path
+import argparse
+
+from scripts.parsers.pft import PFTParse
+import scripts.parsers.textextract as textextract
+
+def main():
+    ap = argparse.ArgumentParser(description='Check PFTParse gives the same results with each text extractor')
+    ap.add_argument('dir', help='Directory of PFT pdfs to check')
+    ap.add_argument('--extractors', nargs='+', default=list(textextract.EXTRACTORS), \
+                    choices=list(textextract.EXTRACTORS))
+    args = ap.parse_args()
+
+    files = sorted(Path(args.dir).rglob('*.pdf'))
+    mismatched = 0
+    for f in files:
+        if not compare(f, args.extractors):
+            mismatched += 1
+    print('{0} of {1} files differ between {2}'.format(mismatched, len(files), \
+                                                      ', '.join(args.extractors)))
+    return (1 if mismatched > 0 else 0)
+
+def compare(f: Path, extractors: list) -> bool:
+    """
+    Parse f with each extractor and print any fields that differ from the first
+    Returns True if all extractors give identical results
+    """
+    results = dict()
+    for name in extractors:
+        res = PFTParse(f, textextract.get_extractor(name))
+        results[name] = (res.error_code, res.get_data())
+
+    base = extractors[0]
+    same = True
+    for name in extractors[1:]:
+        if results[name] == results[base]:
+            continue
+        same = False
+        print('{0}: {1} and {2} differ'.format(f, base, name))
+        if results[name][0] is not results[base][0]:
+            print('    error code: {0} / {1}'.format(results[base][0].name, results[name][0].name))
+        a = results[base][1]
+        b = results[name][1]
+        for key in sorted(set(a) | set(b)):
+            if a.get(key) != b.get(key):
+                print('    {0}: {1} / {2}'.format(key, a.get(key), b.get(key)))
+    return same
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,6 @@
 # Database definitions
 
-from sqlalchemy import Column, ForeignKey, Integer, String, Date, Float, Text, DateTime
+from sqlalchemy import Column, ForeignKey, Integer, String, Date, Float, Text, DateTime, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -18,6 +18,10 @@ class Patient(Base):
 
 class Spirometry(Base):
     __tablename__ = 'spirometry'
+    # One study per patient per date - the writer updates rather than duplicates
+    # Study dates are indexed for the cohort summary's months
+    __table_args__ = (Index('ix_spirometry_subject_date', 'subject_id', 'study_date', unique = True),
+                      Index('ix_spirometry_study_date', 'study_date'))
     id = Column(Integer, primary_key = True)
     
     subject_id = Column(Integer, ForeignKey('patient.id'))
@@ -47,6 +51,7 @@ class Spirometry(Base):
   
 class Lungfunc(Base):
     __tablename__ = 'lungfunc'
+    __table_args__ = (Index('ix_lungfunc_subject_date', 'subject_id', 'study_date', unique = True),)
     id = Column(Integer, primary_key = True)
     
     subject_id = Column(Integer, ForeignKey('patient.id'))
@@ -97,6 +102,7 @@ class Lungfunc(Base):
 
 class Physiology(Base):
     __tablename__ = 'physiology'
+    __table_args__ = (Index('ix_physiology_subject_date', 'subject_id', 'study_date', unique = True),)
     id = Column(Integer, primary_key = True)
 
     subject_id = Column(Integer, ForeignKey('patient.id'))
@@ -105,3 +111,144 @@ class Physiology(Base):
     study_date = Column(Date)
     height = Column(Float)
     weight = Column(Float)
+
+class Oximetry(Base):
+    __tablename__ = 'oximetry'
+    # One study per patient per date per device
+    __table_args__ = (Index('ix_oximetry_subject_date', 'subject_id', 'study_date', 'device', unique = True),)
+    id = Column(Integer, primary_key = True)
+
+    subject_id = Column(Integer, ForeignKey('patient.id'))
+    subject = relationship('Patient')
+
+    study_date = Column(Date)
+    device = Column(String(20))
+    odi = Column(Float)
+    hri = Column(Float)
+    report = Column(Text)
+
+class IngestManifest(Base):
+    __tablename__ = 'ingest_manifest'
+    id = Column(Integer, primary_key = True)
+
+    path = Column(String(500), unique = True)
+    size = Column(Integer)
+    mtime = Column(Float)
+    sha256 = Column(String(64))
+
+    parser = Column(String(30))
+    outcome = Column(String(30))
+    row_ids = Column(Text)
+    scanned = Column(DateTime)
+
+class PatientFlag(Base):
+    __tablename__ = 'patient_flag'
+    __table_args__ = (Index('ix_patient_flag_patient', 'patient_id'),)
+    id = Column(Integer, primary_key = True)
+
+    patient_id = Column(Integer, ForeignKey('patient.id'))
+    patient = relationship('Patient', foreign_keys = [patient_id])
+    other_id = Column(Integer, ForeignKey('patient.id'))
+    other = relationship('Patient', foreign_keys = [other_id])
+
+    kind = Column(String(20))
+    detail = Column(Text)
+    source = Column(String(20))
+    created = Column(DateTime)
+
+class Quarantine(Base):
+    __tablename__ = 'quarantine'
+    id = Column(Integer, primary_key = True)
+
+    path = Column(String(500), unique = True)
+    size = Column(Integer)
+    mtime = Column(Float)
+    sha256 = Column(String(64))
+
+    outcome = Column(String(30))
+    error = Column(Text)
+    snippet = Column(Text)
+    attempts = Column(Integer)
+    first_failed = Column(DateTime)
+    last_failed = Column(DateTime)
+    next_retry = Column(DateTime)
+
+class ImportJob(Base):
+    __tablename__ = 'import_job'
+    id = Column(Integer, primary_key = True)
+
+    root = Column(String(500))
+    options = Column(Text)
+    status = Column(String(20))
+    walked = Column(Boolean)
+    files = Column(Integer)
+    done = Column(Integer)
+    started = Column(DateTime)
+    updated = Column(DateTime)
+    finished = Column(DateTime)
+
+class ImportFile(Base):
+    __tablename__ = 'import_file'
+    # Work list of an import job, in the order the files were found
+    __table_args__ = (Index('ix_import_file_job_seq', 'job_id', 'seq', unique = True),)
+    id = Column(Integer, primary_key = True)
+
+    job_id = Column(Integer, ForeignKey('import_job.id'))
+    job = relationship('ImportJob')
+    seq = Column(Integer)
+    path = Column(String(500))
+    status = Column(String(20))
+    outcome = Column(String(30))
+
+class Derived(Base):
+    __tablename__ = 'derived'
+    __table_args__ = (Index('ix_derived_subject_date', 'subject_id', 'study_date'),)
+    id = Column(Integer, primary_key = True)
+
+    spiro_id = Column(Integer, ForeignKey('spirometry.id'), unique = True)
+    spiro = relationship('Spirometry')
+    subject_id = Column(Integer, ForeignKey('patient.id'))
+    study_date = Column(Date)
+
+    age = Column(Float)
+    bmi = Column(Float)
+    fev1_fvc = Column(Float)
+    fev1_fvc_post = Column(Float)
+    fev1_z = Column(Float)
+    fvc_z = Column(Float)
+    fev1_fvc_z = Column(Float)
+    computed = Column(DateTime)
+
+class Trend(Base):
+    __tablename__ = 'trend'
+    __table_args__ = (Index('ix_trend_subject_measure', 'subject_id', 'measure', unique = True),)
+    id = Column(Integer, primary_key = True)
+
+    subject_id = Column(Integer, ForeignKey('patient.id'))
+    subject = relationship('Patient')
+    measure = Column(String(20))
+
+    n = Column(Integer)
+    last_id = Column(Integer)
+    first_date = Column(Date)
+    last_date = Column(Date)
+    slope = Column(Float)
+    intercept = Column(Float)
+    resid_sd = Column(Float)
+    computed = Column(DateTime)
+
+class CohortSummary(Base):
+    __tablename__ = 'cohort_summary'
+    __table_args__ = (Index('ix_cohort_summary_month_group', 'month', 'sex', 'age_band', unique = True),)
+    id = Column(Integer, primary_key = True)
+
+    month = Column(Date)
+    sex = Column(String(10))
+    age_band = Column(String(10))
+
+    studies = Column(Integer)
+    with_lungfunc = Column(Integer)
+    fev1_pp_n = Column(Integer)
+    fev1_pp_median = Column(Float)
+    last_id = Column(Integer)
+    computed = Column(DateTime)
@@ -0,0 +1,120 @@
+# Database connection set up - url, engine options and SQLite tuning
+
+from contextlib import contextmanager
+import logging
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+# Environment variable with the database url, used when none is given
+DB_URL_ENV = 'LUNGDB_DB_URL'
+DEFAULT_DB_URL = 'sqlite:///.///logs///pfts.db'
+
+# Per connection SQLite settings. Normal use keeps SQLite's safe defaults;
+# bulk loading trades durability of the last few transactions after a power
+# cut (never consistency, with WAL) for fewer fsyncs and a bigger cache
+SAFE_PRAGMAS = {'synchronous': 'FULL',
+                'cache_size': -2000,        # 2MB
+                'mmap_size': 0,
+                'temp_store': 'DEFAULT'}
+BULK_PRAGMAS = {'synchronous': 'NORMAL',
+                'cache_size': -262144,      # 256MB
+                'mmap_size': 1073741824,    # 1GB
+                'temp_store': 'MEMORY'}
+
+# Seconds a connection waits for another's lock before giving up - readers
+# and the importer share the file
+BUSY_TIMEOUT = 30
+
+def get_url(url: str = None) -> str:
+    """
+    Returns url, or $LUNGDB_DB_URL, or the default SQLite file if neither is set
+    """
+    if url is None:
+        url = os.environ.get(DB_URL_ENV, DEFAULT_DB_URL)
+    return url
+
+class Database:
+    """
+    An engine plus the settings for using it
+    url - SQLAlchemy database url, see get_url()
+    engine_options - passed on to create_engine(), e.g. echo, pool_size
+    For SQLite every connection gets SAFE_PRAGMAS, or BULK_PRAGMAS inside
+    bulk_load(). Connections are checked when they are taken from the pool so
+    ones opened before a change of mode pick it up too
+    """
+    def __init__(self, url: str = None, **engine_options):
+        self.url = get_url(url)
+        self.is_sqlite = make_url(self.url).get_backend_name() == 'sqlite'
+        if self.is_sqlite:
+            engine_options.setdefault('connect_args', {}).setdefault('timeout', BUSY_TIMEOUT)
+        self.engine = create_engine(self.url, **engine_options)
+        self.bulk = False
+        if self.is_sqlite:
+            event.listen(self.engine, 'checkout', self._on_checkout)
+
+    def _on_checkout(self, dbapi_conn, record, proxy):
+        if record.info.get('bulk') is self.bulk:
+            return
+        pragmas = (BULK_PRAGMAS if self.bulk else SAFE_PRAGMAS)
+        cur = dbapi_conn.cursor()
+        for k, v in pragmas.items():
+            cur.execute('PRAGMA {0} = {1}'.format(k, v))
+        cur.close()
+        record.info['bulk'] = self.bulk
+
+    def session(self):
+        return sessionmaker(bind = self.engine)()
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Context manager for a large import. For SQLite switches the file to
+        WAL, so reports can still be read while the import runs, and uses
+        BULK_PRAGMAS on every connection until the block ends. Afterwards the
+        WAL is checkpointed, the previous journal mode restored and
+        connections go back to SAFE_PRAGMAS
+        Other databases are left as they are
+        """
+        if not self.is_sqlite:
+            yield
+            return
+
+        with self.engine.connect() as conn:
+            mode = conn.exec_driver_sql('PRAGMA journal_mode').scalar()
+            conn.exec_driver_sql('PRAGMA journal_mode = WAL')
+        logging.info('Bulk load mode on (journal mode was {0})'.format(mode))
+        self.bulk = True
+        try:
+            yield
+        finally:
+            self.bulk = False
+            # Close idle pooled connections - the journal mode can only be
+            # changed from WAL by the only connection to the file
+            self.engine.dispose()
+            with self.engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+                if mode.lower() != 'wal':
+                    res = conn.exec_driver_sql('PRAGMA journal_mode = {0}'.format(mode)).scalar()
+                    if res.lower() != mode.lower():
+                        # Can't leave WAL while another connection has the file open
+                        logging.warning('Unable to restore journal mode {0}, still {1}'.format(mode, res))
+            logging.info('Bulk load mode off')
+
+    def reader(self, pool_size: int = 5, **engine_options):
+        """
+        A separate engine for read only reporting, safe to use while an import
+        runs. SQLite files are opened read only (the file must be in WAL mode,
+        e.g. during bulk_load(), for reads not to wait on the writer)
+        """
+        engine_options.setdefault('pool_size', pool_size)
+        engine_options.setdefault('pool_pre_ping', True)
+        url = make_url(self.url)
+        if self.is_sqlite and url.database not in [None, '', ':memory:']:
+            path = os.path.abspath(url.database)
+            engine_options.setdefault('connect_args', {}).setdefault('timeout', BUSY_TIMEOUT)
+            engine_options.setdefault('poolclass', QueuePool)
+            return create_engine('sqlite:///file:{0}?mode=ro&uri=true'.format(path), **engine_options)
+        return create_engine(self.url, **engine_options)
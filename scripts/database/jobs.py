@@ -0,0 +1,183 @@
+# Import jobs - the work list and progress of a scan, so it can be resumed
+
+import scripts.database.db as db
+from sqlalchemy import select, and_, bindparam
+from pathlib import Path
+import datetime as dt
+import json
+import logging
+import threading
+
+# Status of a file in a job's work list
+FILE_PENDING = 'pending'
+FILE_DONE = 'done'
+
+# Status of a job. A job left running by a process that died stays RUNNING
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+# Most files found before the work list is written out
+CHECKPOINT_SIZE = 500
+
+# Pending files read from the work list in one query when resuming
+PAGE_SIZE = 5000
+
+class ImportJob:
+    """
+    A scan of one directory recorded in the database, so that if it stops part
+    way through it can be resumed without reading the files it finished again
+    The job holds the scan's options, a work list of the files to read in the
+    order they were found, and whether each has been done. add() puts a file on
+    the work list and mark() records it as done once its results have been
+    committed. Both are saved by checkpoint(), which the scan calls after each
+    batch is written, and new files are also saved every CHECKPOINT_SIZE
+    add() and mark() can be called from different threads. Changes are written
+    in short transactions of their own, not through the ingest session
+    """
+    def __init__(self, engine, job_id: int):
+        self.engine = engine
+        self.id = job_id
+        self.lock = threading.Lock()
+        self.seqs = dict()
+        self.new = []
+        self.marked = []
+
+        j = db.ImportJob.__table__
+        f = db.ImportFile.__table__
+        with engine.connect() as conn:
+            job = conn.execute(select(j).where(j.c.id == job_id)).mappings().first()
+            if job is None:
+                raise ValueError('No import job {0}'.format(job_id))
+            for seq, path in conn.execute(select(f.c.seq, f.c.path).where(f.c.job_id == job_id)):
+                self.seqs[path] = seq
+        self.root = Path(job['root'])
+        self.options = json.loads(job['options'])
+        self.status = job['status']
+        self.walked = bool(job['walked'])
+        self.done = job['done']
+
+    @classmethod
+    def create(cls, engine, root: Path, options: dict):
+        """
+        Start a new job for a scan of root. options are saved with it (as
+        JSON) for resuming
+        """
+        now = dt.datetime.now()
+        with engine.begin() as conn:
+            res = conn.execute(db.ImportJob.__table__.insert() \
+                               .values(root = Path(root).absolute().as_posix(), options = json.dumps(options), \
+                                       status = JOB_RUNNING, walked = False, files = 0, done = 0, \
+                                       started = now, updated = now))
+            job_id = res.inserted_primary_key[0]
+        logging.info('Started import job {0} for {1}'.format(job_id, root))
+        return cls(engine, job_id)
+
+    @classmethod
+    def resume(cls, engine, job_id: int):
+        """
+        Load an unfinished job to carry on with it
+        """
+        job = cls(engine, job_id)
+        if job.status == JOB_FINISHED:
+            raise ValueError('Import job {0} has already finished'.format(job_id))
+        job.status = JOB_RUNNING
+        job._save_job()
+        logging.info('Resuming import job {0}: {1} of {2} files done'.format(job_id, job.done, len(job.seqs)))
+        return job
+
+    def has(self, f: Path) -> bool:
+        return _key(f) in self.seqs
+
+    def add(self, f: Path):
+        """
+        Add f to the end of the work list
+        """
+        with self.lock:
+            seq = len(self.seqs)
+            self.seqs[_key(f)] = seq
+            self.new.append({'job_id': self.id, 'seq': seq, 'path': _key(f), 'status': FILE_PENDING})
+            full = len(self.new) >= CHECKPOINT_SIZE
+        if full:
+            self.checkpoint()
+
+    def mark(self, f: Path, outcome: str):
+        """
+        Record f as done - saved at the next checkpoint()
+        """
+        with self.lock:
+            self.marked.append({'_job': self.id, '_seq': self.seqs[_key(f)], '_outcome': outcome})
+
+    def remaining(self):
+        """
+        Generator yielding the files on the work list that aren't done, in
+        order. Files added after it is called aren't included
+        """
+        f = db.ImportFile.__table__
+        end = len(self.seqs)
+        after = -1
+        while True:
+            with self.engine.connect() as conn:
+                rows = conn.execute(select(f.c.seq, f.c.path) \
+                                    .where(and_(f.c.job_id == self.id, f.c.status == FILE_PENDING, \
+                                                f.c.seq > after, f.c.seq < end)) \
+                                    .order_by(f.c.seq).limit(PAGE_SIZE)).all()
+            if len(rows) == 0:
+                return
+            for _, path in rows:
+                yield Path(path)
+            after = rows[-1][0]
+
+    def walk_finished(self):
+        """
+        Every file has been found - a resumed job won't walk the directory again
+        """
+        self.walked = True
+        self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Save the files added and marked done since the last checkpoint
+        """
+        f = db.ImportFile.__table__
+        with self.lock:
+            new, self.new = self.new, []
+            marked, self.marked = self.marked, []
+            # New files first, as some of those marked may be among them
+            with self.engine.begin() as conn:
+                if len(new) > 0:
+                    conn.execute(f.insert(), new)
+                if len(marked) > 0:
+                    conn.execute(f.update().where(and_(f.c.job_id == bindparam('_job'), \
+                                                       f.c.seq == bindparam('_seq'))) \
+                                 .values(status = FILE_DONE, outcome = bindparam('_outcome')), marked)
+                self.done += len(marked)
+                self._save_job(conn)
+
+    def finish(self, status: str = JOB_FINISHED):
+        self.checkpoint()
+        self.status = status
+        self._save_job()
+        logging.info('Import job {0} {1}: {2} of {3} files done'.format(self.id, status, self.done, len(self.seqs)))
+
+    def _save_job(self, conn = None):
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self._save_job(conn)
+        now = dt.datetime.now()
+        conn.execute(db.ImportJob.__table__.update().where(db.ImportJob.__table__.c.id == self.id) \
+                     .values(status = self.status, walked = self.walked, files = len(self.seqs), \
+                             done = self.done, updated = now, \
+                             finished = (now if self.status == JOB_FINISHED else None)))
+
+def list_jobs(engine, n: int = 20) -> list:
+    """
+    The n most recent jobs as (id, root, status, files done, files, started)
+    """
+    j = db.ImportJob.__table__
+    with engine.connect() as conn:
+        return conn.execute(select(j.c.id, j.c.root, j.c.status, j.c.done, j.c.files, j.c.started) \
+                            .order_by(j.c.id.desc()).limit(n)).all()
+
+def _key(f: Path) -> str:
+    return Path(f).absolute().as_posix()
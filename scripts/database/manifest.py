@@ -0,0 +1,138 @@
+# Ingest manifest - remembers which pdfs have already been read
+
+import scripts.database.db as db
+from scripts.parsers.textcache import file_hash
+from pathlib import Path
+from collections import defaultdict
+import datetime as dt
+import json
+import logging
+
+# Tables that rows listed in IngestManifest.row_ids can come from
+# Ordered so that rows referencing others are deleted first
+ROW_TABLES = {'lungfunc': db.Lungfunc,
+              'physiology': db.Physiology,
+              'spirometry': db.Spirometry,
+              'oximetry': db.Oximetry}
+
+class Manifest:
+    """
+    Fingerprints (path, size, mtime, content hash) of files already ingested
+    All entries are loaded up front so checking a file costs a stat() and a
+    dict lookup. The file is only hashed if its size or mtime have changed
+    is_unchanged() only reads a snapshot of the fingerprints, so it can run in
+    a different thread to record() and commit(), which use the session
+    Identical copies of a report update the same rows, so the paths listing
+    each row are kept too, and a row is only deleted once no file lists it
+    """
+    def __init__(self, session):
+        self.session = session
+        self.entries = {m.path: m for m in session.query(db.IngestManifest)}
+        self.fingerprints = {m.path: (m.size, m.mtime, m.sha256) for m in self.entries.values()}
+        self.hashes = dict()
+        self.touched = []
+        self.refs = defaultdict(set)
+        for m in self.entries.values():
+            if m.row_ids:
+                for table, ids in json.loads(m.row_ids).items():
+                    for i in ids:
+                        self.refs[(table, i)].add(m.path)
+
+    def is_unchanged(self, f: Path) -> bool:
+        """
+        True if f is in the manifest with the same fingerprint
+        A file that has been touched but not altered is treated as unchanged,
+        and has its mtime updated at the next commit()
+        """
+        key = f.resolve().as_posix()
+        fp = self.fingerprints.get(key)
+        if fp is None:
+            return False
+
+        try:
+            st = f.stat()
+            if fp[0] == st.st_size and fp[1] == st.st_mtime:
+                return True
+            digest = file_hash(f)
+        except OSError:
+            # Deleted or moved since it was found - nothing to read
+            return True
+        if fp[2] == digest:
+            self.touched.append((key, st.st_size, st.st_mtime))
+            return True
+
+        self.hashes[key] = digest
+        return False
+
+    def record(self, f: Path, parser: str, outcome: str, row_ids: dict):
+        """
+        Add or update the manifest entry for f - call commit() to save it
+        If f was ingested before, rows from the earlier version that the new
+        one didn't update are deleted, so a changed file replaces its old
+        results rather than duplicating them - unless another file still lists
+        them. If nothing could be read from the new version the earlier
+        results are kept
+        A file deleted or moved since it was read isn't recorded - its rows are
+        kept, and it is read again if it comes back
+        """
+        key = f.resolve().as_posix()
+        try:
+            st = f.stat()
+            digest = (self.hashes.pop(key) if key in self.hashes else file_hash(f))
+        except OSError as e:
+            logging.warning('Not recording {0} in the manifest: {1}'.format(key, e))
+            return
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = db.IngestManifest(path = key)
+            self.session.add(entry)
+            self.entries[key] = entry
+        old = (json.loads(entry.row_ids) if entry.row_ids else dict())
+        if not row_ids:
+            row_ids = old
+        for table, ids in old.items():
+            for i in ids:
+                self.refs[(table, i)].discard(key)
+        for table, ids in row_ids.items():
+            for i in ids:
+                self.refs[(table, i)].add(key)
+        self._delete_rows({table: [i for i in ids if len(self.refs[(table, i)]) == 0] for table, ids in old.items()})
+
+        entry.size = st.st_size
+        entry.mtime = st.st_mtime
+        entry.sha256 = digest
+        self.fingerprints[key] = (entry.size, entry.mtime, entry.sha256)
+        entry.parser = parser
+        entry.outcome = outcome
+        entry.row_ids = json.dumps(row_ids) if row_ids else None
+        entry.scanned = dt.datetime.now()
+
+    def commit(self):
+        while len(self.touched) > 0:
+            key, size, mtime = self.touched.pop()
+            self.entries[key].size = size
+            self.entries[key].mtime = mtime
+        self.session.commit()
+
+    def _delete_rows(self, row_ids: dict):
+        for table, ids in row_ids.items():
+            for i in ids:
+                self.refs.pop((table, i), None)
+        # The months losing studies need their cohort summaries recomputed
+        months = set()
+        for table in ['spirometry', 'lungfunc']:
+            model = ROW_TABLES[table]
+            if len(row_ids.get(table, [])) > 0:
+                months.update(d.replace(day = 1) for d, in self.session.query(model.study_date) \
+                              .filter(model.id.in_(row_ids[table])) if d is not None)
+        if len(months) > 0:
+            self.session.query(db.CohortSummary).filter(db.CohortSummary.month.in_(sorted(months))) \
+                .delete(synchronize_session = False)
+        if len(row_ids.get('spirometry', [])) > 0:
+            self.session.query(db.Derived).filter(db.Derived.spiro_id.in_(row_ids['spirometry'])) \
+                .delete(synchronize_session = False)
+        for table, model in ROW_TABLES.items():
+            if len(row_ids.get(table, [])) > 0:
+                logging.info('Replacing {0} rows {1}'.format(table, row_ids[table]))
+                self.session.query(model).filter(model.id.in_(row_ids[table])) \
+                    .delete(synchronize_session = False)
@@ -0,0 +1,56 @@
+# In-memory map of RXR to patient id for an ingest run
+
+import scripts.database.db as db
+from sqlalchemy import select
+
+class PatientCache:
+    """
+    Identity map of rxr -> patient.id
+    Loaded once from the patient table at the start of a scan and kept up to
+    date as the writer creates patients, so resolving a report's RXR is a
+    dict lookup rather than a query
+    """
+    def __init__(self):
+        self.ids = dict()
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, conn):
+        """
+        Read every (rxr, id) pair from the patient table
+        conn can be an engine or a connection
+        """
+        t = db.Patient.__table__
+        if hasattr(conn, 'connect'):
+            with conn.connect() as c:
+                rows = c.execute(select(t.c.rxr, t.c.id)).fetchall()
+        else:
+            rows = conn.execute(select(t.c.rxr, t.c.id)).fetchall()
+        self.ids = {r.rxr: r.id for r in rows if r.rxr is not None}
+        self.loaded = True
+
+    def get(self, rxr: str):
+        """
+        Returns the patient id for rxr, or None if the patient is new
+        """
+        pid = self.ids.get(rxr)
+        if pid is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return pid
+
+    def add(self, rxr: str, pid: int):
+        self.ids[rxr] = pid
+
+    def discard(self, rxrs: list):
+        """
+        Forget patients whose insert was rolled back
+        """
+        for rxr in rxrs:
+            self.ids.pop(rxr, None)
+
+    def summary(self) -> str:
+        return 'Patient cache: {0} patients, {1} hits, {2} misses'.format(len(self.ids), \
+                                                                        self.hits, self.misses)
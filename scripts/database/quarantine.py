@@ -0,0 +1,128 @@
+# Quarantine - files that failed to be read, retried with exponential backoff
+
+import scripts.database.db as db
+from scripts.parsers.textcache import file_hash
+from pathlib import Path
+import datetime as dt
+import logging
+
+# Wait before the first retry of a failed file - doubled after each further
+# failure, and the file is given up on after MAX_ATTEMPTS failures
+RETRY_DELAY = dt.timedelta(hours = 1)
+MAX_ATTEMPTS = 5
+
+# Characters of a failed file's text kept to show what it looked like
+SNIPPET_SIZE = 500
+
+class Quarantine:
+    """
+    Files that couldn't be read, with the kind of failure, the error and the
+    start of their text
+    A quarantined file is skipped by scans without being read until its retry
+    is due (after RETRY_DELAY, then twice as long after each failure) or it
+    changes. After MAX_ATTEMPTS failures it is only read again if it changes
+    or is re-driven with redrive(). A file that is read successfully is
+    released
+    As with the Manifest, entries are loaded up front: is_held() and is_due()
+    only read a snapshot, so they can run in a different thread to add() and
+    release(), which use the session. Changes are saved when the session is
+    committed
+    """
+    def __init__(self, session):
+        self.session = session
+        self.entries = {q.path: q for q in session.query(db.Quarantine)}
+        self.snapshot = {q.path: (q.size, q.mtime, q.next_retry) for q in self.entries.values()}
+
+    def is_held(self, f: Path) -> bool:
+        """
+        True if f is quarantined, hasn't changed and isn't due to be retried
+        """
+        entry = self.snapshot.get(f.resolve().as_posix())
+        if entry is None:
+            return False
+        try:
+            st = f.stat()
+        except OSError:
+            return False
+        if entry[0] != st.st_size or entry[1] != st.st_mtime:
+            return False
+        return entry[2] is None or entry[2] > dt.datetime.now()
+
+    def is_due(self, f: Path) -> bool:
+        """
+        True if f is quarantined and due to be retried
+        """
+        entry = self.snapshot.get(f.resolve().as_posix())
+        return entry is not None and entry[2] is not None and entry[2] <= dt.datetime.now()
+
+    def add(self, f: Path, outcome: str, error: str = None, text: str = None):
+        """
+        Record a failure to read f - outcome is the kind of failure, e.g. the
+        parser's error code. The attempts are counted again from one if f has
+        changed since it was quarantined
+        """
+        key = f.resolve().as_posix()
+        try:
+            st = f.stat()
+            digest = file_hash(f)
+        except OSError as e:
+            logging.error('Unable to quarantine {0}: {1}'.format(key, e))
+            return
+        now = dt.datetime.now()
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = db.Quarantine(path = key)
+            self.session.add(entry)
+            self.entries[key] = entry
+        if entry.sha256 != digest:
+            entry.attempts = 0
+            entry.first_failed = now
+
+        entry.attempts += 1
+        entry.size = st.st_size
+        entry.mtime = st.st_mtime
+        entry.sha256 = digest
+        entry.outcome = outcome
+        entry.error = error
+        entry.snippet = (text[:SNIPPET_SIZE] if text else None)
+        entry.last_failed = now
+        if entry.attempts < MAX_ATTEMPTS:
+            entry.next_retry = now + RETRY_DELAY * 2 ** (entry.attempts - 1)
+            logging.warning('Quarantined {0} ({1}), attempt {2} - retry after {3:%Y-%m-%d %H:%M}'.format( \
+                key, outcome, entry.attempts, entry.next_retry))
+        else:
+            entry.next_retry = None
+            logging.warning('Quarantined {0} ({1}), giving up after {2} attempts'.format(key, outcome, entry.attempts))
+        self.snapshot[key] = (entry.size, entry.mtime, entry.next_retry)
+
+    def release(self, f: Path):
+        """
+        f has been read successfully - take it out of quarantine
+        """
+        key = f.resolve().as_posix()
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.session.delete(entry)
+            del self.snapshot[key]
+            logging.info('Released {0} from quarantine'.format(key))
+
+def redrive(session, outcome: str = None) -> int:
+    """
+    Make every quarantined file (or those that failed with outcome) due for a
+    retry now, with its attempts counted from the start again
+    Returns the number of files re-driven
+    """
+    query = session.query(db.Quarantine)
+    if outcome is not None:
+        query = query.filter(db.Quarantine.outcome == outcome)
+    n = query.update({db.Quarantine.attempts: 0, db.Quarantine.next_retry: dt.datetime.now()}, \
+                     synchronize_session = False)
+    session.commit()
+    logging.info('Re-drove {0} quarantined files'.format(n))
+    return n
+
+def quarantined(session) -> list:
+    """
+    Every quarantined file, most recent failure first
+    """
+    return session.query(db.Quarantine).order_by(db.Quarantine.last_failed.desc()).all()
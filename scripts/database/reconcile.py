@@ -0,0 +1,350 @@
+# Patient reconciliation - finds reports and patients that disagree about who someone is
+
+import scripts.database.db as db
+from sqlalchemy import select
+from collections import defaultdict
+from functools import lru_cache
+from itertools import combinations
+import datetime as dt
+import logging
+
+# Kinds of patient flag
+FLAG_CONFLICT = 'CONFLICT'      # a report's details differ from its patient's
+FLAG_DUPLICATE = 'DUPLICATE'    # two patients are probably the same person
+
+# Blocks with more patients than this (e.g. a very common name) aren't
+# compared pairwise, which keeps the audit close to linear
+MAX_BLOCK = 100
+
+# Most flags checked for in one query
+LOOKUP_SIZE = 400
+
+_SOUNDEX = {c: str(d) for d, letters in enumerate(['AEIOUYHW', 'BFPV', 'CGJKQSXZ', 'DT', 'L', 'MN', 'R']) \
+            for c in letters}
+
+@lru_cache(maxsize = 65536)
+def soundex(name: str) -> str:
+    """
+    American Soundex code of name (e.g. Robert and Rupert are both R163), or
+    None if it has no letters. Memoized, as names repeat across patients
+    """
+    letters = [c for c in (name or '').upper() if c in _SOUNDEX]
+    if len(letters) == 0:
+        return None
+    code = letters[0]
+    last = _SOUNDEX[letters[0]]
+    for c in letters[1:]:
+        d = _SOUNDEX[c]
+        if d != '0' and d != last:
+            code += d
+        # H and W don't separate letters with the same code, vowels do
+        if c not in 'HW':
+            last = d
+    return (code + '000')[:4]
+
+def normalise_rxr(rxr: str) -> str:
+    """
+    RXR in upper case without spaces or punctuation
+    """
+    if rxr is None:
+        return None
+    rxr = rxr.upper()
+    if rxr.isalnum():
+        return rxr
+    return ''.join(c for c in rxr if c.isalnum()) or None
+
+def rxr_variants(rxr: str) -> list:
+    """
+    The normalised RXR with each character left out in turn. Two RXRs that
+    differ by one character changed, added, removed or swapped with its
+    neighbour share at least one variant
+    """
+    rxr = normalise_rxr(rxr)
+    if rxr is None:
+        return []
+    return sorted({rxr[:i] + rxr[i + 1:] for i in range(len(rxr))})
+
+def rxr_close(a: str, b: str) -> bool:
+    """
+    True if normalised RXRs a and b differ by a single typing error: one
+    character changed, added or removed, or two neighbours swapped
+    """
+    a = normalise_rxr(a)
+    b = normalise_rxr(b)
+    if a is None or b is None or a == b:
+        return False
+    if len(a) == len(b):
+        return _one_typo(a, b)
+    if abs(len(a) - len(b)) == 1:
+        short, long = sorted([a, b], key = len)
+        return any(long[:i] + long[i + 1:] == short for i in range(len(long)))
+    return False
+
+def _one_typo(a: str, b: str) -> bool:
+    """
+    True if strings a and b, of the same length, differ by one character or
+    by two neighbouring characters swapped
+    """
+    diff = [i for i in range(len(a)) if a[i] != b[i]]
+    return len(diff) == 1 or \
+        (len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+
+def dob_close(a: dt.date, b: dt.date) -> bool:
+    """
+    True if dates of birth a and b differ in a way that looks like a typing
+    error: day and month swapped, or only one of day, month and year differs
+    - a year only by one digit or two neighbouring digits swapped, so 1969
+    and 1984 aren't close
+    """
+    if a is None or b is None or a == b:
+        return False
+    if a.day == b.month and a.month == b.day and a.year == b.year:
+        return True
+    if a.day != b.day or a.month != b.month:
+        return a.year == b.year and (a.day == b.day or a.month == b.month)
+    return _one_typo('{0:04d}'.format(a.year), '{0:04d}'.format(b.year))
+
+def _same_name(a: str, b: str) -> bool:
+    return a is not None and b is not None and a.lower() == b.lower()
+
+def _keyed(row: dict) -> dict:
+    """
+    row with the normalised RXR and Soundex codes of the names added, so
+    they are worked out once per patient rather than once per comparison
+    """
+    if '_rxr' in row:
+        return row
+    return dict(row, _rxr = normalise_rxr(row['rxr']), _lname = soundex(row['lname']), \
+                _fname = soundex(row['fname']))
+
+def duplicate_reasons(a: dict, b: dict) -> list:
+    """
+    Why patients a and b (dicts of patient columns) look like the same person,
+    or an empty list if they don't
+    """
+    a = _keyed(a)
+    b = _keyed(b)
+    same_rxr = a['_rxr'] is not None and a['_rxr'] == b['_rxr']
+    same_dob = a['dob'] is not None and a['dob'] == b['dob']
+    surname_alike = a['_lname'] is not None and a['_lname'] == b['_lname']
+    # Every rule needs one of these - most candidate pairs stop here
+    dob_near = same_dob or dob_close(a['dob'], b['dob'])
+    if not (same_rxr or dob_near or surname_alike):
+        return []
+
+    reasons = []
+    first_alike = (a['_fname'] is not None and a['_fname'] == b['_fname']) or \
+        (a['fname'] and b['fname'] and a['fname'][0].upper() == b['fname'][0].upper())
+    if same_rxr:
+        reasons.append('same RXR')
+    elif rxr_close(a['_rxr'], b['_rxr']) and (same_dob or (dob_near and surname_alike and first_alike)):
+        # RXRs are handed out in sequence so near misses are common - the
+        # dates of birth have to match too, or differ by a typo with the
+        # names alike
+        reasons.append('RXR differs by one character')
+    if same_dob and surname_alike and first_alike:
+        reasons.append('same date of birth and name')
+    elif dob_near and not same_dob and _same_name(a['lname'], b['lname']) and _same_name(a['fname'], b['fname']):
+        reasons.append('same name, date of birth differs by a typo')
+    return reasons
+
+def conflicts(stored: dict, report: dict) -> list:
+    """
+    Differences between a patient's stored details and those in a report
+    with the same RXR, as descriptions. Details missing from either are ignored
+    """
+    found = []
+    for key, name in [('dob', 'date of birth'), ('lname', 'surname'), ('fname', 'first name'), ('sex', 'sex')]:
+        a = stored.get(key)
+        b = report.get(key)
+        if a is None or b is None:
+            continue
+        if (a.lower() != b.lower() if isinstance(a, str) else a != b):
+            found.append('{0} {1} in database, {2} in report'.format(name, a, b))
+    return found
+
+class PatientIndex:
+    """
+    Blocking indexes over the patient table, so that patients who may be the
+    same person can be found without comparing every pair
+    Patients are indexed under each of:
+        their RXR with one character left out (see rxr_variants())
+        date of birth and Soundex of surname
+        Soundex of surname and first name
+    and only patients sharing a block are compared, with duplicate_reasons()
+    Loaded once, like the PatientCache, and kept up to date as patients are
+    added
+    """
+    def __init__(self, max_block: int = MAX_BLOCK):
+        self.max_block = max_block
+        self.patients = dict()
+        self.by_rxr = dict()
+        self.blocks = defaultdict(set)
+        self.loaded = False
+
+    def load(self, conn):
+        """
+        Index every patient - conn can be an engine or a connection
+        """
+        t = db.Patient.__table__
+        query = select(t.c.id, t.c.rxr, t.c.lname, t.c.fname, t.c.dob, t.c.sex)
+        if hasattr(conn, 'connect'):
+            with conn.connect() as c:
+                rows = c.execute(query).mappings().all()
+        else:
+            rows = conn.execute(query).mappings().all()
+        self.patients = dict()
+        self.by_rxr = dict()
+        self.blocks = defaultdict(set)
+        for row in rows:
+            self.add(dict(row))
+        self.loaded = True
+
+    def keys(self, row: dict) -> list:
+        row = _keyed(row)
+        keys = [('rxr', v) for v in rxr_variants(row['_rxr'])]
+        if row['_lname'] is not None and row['dob'] is not None:
+            keys.append(('dob', row['dob'], row['_lname']))
+        if row['_lname'] is not None and row['_fname'] is not None:
+            keys.append(('name', row['_lname'], row['_fname']))
+        return keys
+
+    def add(self, row: dict):
+        """
+        Index a patient - row has the patient table's columns
+        """
+        row = _keyed({k: row.get(k) for k in ['id', 'rxr', 'lname', 'fname', 'dob', 'sex']})
+        row['_keys'] = self.keys(row)
+        self.patients[row['id']] = row
+        if row['rxr'] is not None:
+            self.by_rxr[row['rxr']] = row['id']
+        for key in row['_keys']:
+            self.blocks[key].add(row['id'])
+
+    def discard(self, rxrs: list):
+        """
+        Forget patients whose insert was rolled back
+        """
+        for rxr in rxrs:
+            pid = self.by_rxr.pop(rxr, None)
+            row = self.patients.pop(pid, None)
+            if row is not None:
+                for key in row['_keys']:
+                    self.blocks[key].discard(pid)
+
+    def duplicates(self, row: dict) -> list:
+        """
+        [(patient id, reasons)] for indexed patients that look like the same
+        person as row
+        """
+        candidates = set()
+        for key in self.keys(row):
+            block = self.blocks.get(key, ())
+            if len(block) <= self.max_block:
+                candidates.update(block)
+        candidates.discard(row.get('id'))
+        found = []
+        for pid in sorted(candidates):
+            reasons = duplicate_reasons(self.patients[pid], row)
+            if len(reasons) > 0:
+                found.append((pid, reasons))
+        return found
+
+    def pairs(self):
+        """
+        Generator yielding (id, id, reasons) for every pair of indexed patients
+        that look like the same person, each pair once - from the first block
+        they share, so nothing has to be remembered between blocks
+        """
+        skipped = 0
+        for key, block in self.blocks.items():
+            if len(block) < 2:
+                continue
+            if len(block) > self.max_block:
+                skipped += 1
+                continue
+            for a, b in combinations(sorted(block), 2):
+                if self._first_shared(a, b) != key:
+                    continue
+                reasons = duplicate_reasons(self.patients[a], self.patients[b])
+                if len(reasons) > 0:
+                    yield (a, b, reasons)
+        if skipped > 0:
+            logging.warning('{0} blocks of more than {1} patients not compared'.format(skipped, self.max_block))
+
+    def _first_shared(self, a: int, b: int) -> tuple:
+        """
+        The first of a's block keys that b shares, skipping oversized blocks
+        """
+        for key in self.patients[a]['_keys']:
+            block = self.blocks.get(key, ())
+            if len(block) <= self.max_block and b in block:
+                return key
+        return None
+
+    def check(self, pid: int, report: dict) -> list:
+        """
+        Flags for a report resolved to patient pid - report has the patient
+        table's columns, as from writer.patient_row()
+        """
+        stored = self.patients.get(pid)
+        if stored is None:
+            return []
+        found = conflicts(stored, report)
+        if len(found) == 0:
+            return []
+        return [flag(pid, None, FLAG_CONFLICT, '; '.join(found))]
+
+    def check_new(self, row: dict) -> list:
+        """
+        Flags for a patient about to be added (row must have its id)
+        """
+        return [flag(min(pid, row['id']), max(pid, row['id']), FLAG_DUPLICATE, ', '.join(reasons)) \
+                for pid, reasons in self.duplicates(row)]
+
+def flag(pid: int, other_id: int, kind: str, detail: str) -> dict:
+    """
+    A patient flag row. For a DUPLICATE pid is the lower of the two ids, so
+    the same pair found at ingest and by an audit is only flagged once
+    """
+    return {'patient_id': pid, 'other_id': other_id, 'kind': kind, 'detail': detail}
+
+def write_flags(conn, flags: list, source: str) -> int:
+    """
+    Insert flags (from flag()) that aren't already recorded
+    Returns the number added
+    """
+    t = db.PatientFlag.__table__
+    key = lambda f: (f['patient_id'], f['other_id'], f['kind'], f['detail'])
+    new = {key(f): f for f in flags}
+    pids = sorted({f['patient_id'] for f in flags})
+    for i in range(0, len(pids), LOOKUP_SIZE):
+        res = conn.execute(select(t.c.patient_id, t.c.other_id, t.c.kind, t.c.detail) \
+                           .where(t.c.patient_id.in_(pids[i:i + LOOKUP_SIZE])))
+        for row in res:
+            new.pop(tuple(row), None)
+    if len(new) == 0:
+        return 0
+    now = dt.datetime.now()
+    conn.execute(t.insert(), [dict(f, source = source, created = now) for f in new.values()])
+    for f in new.values():
+        logging.info('Patient {0} flagged {1}: {2}'.format(f['patient_id'], f['kind'], f['detail']))
+    logging.warning('{0} patient flags added by {1}'.format(len(new), source))
+    return len(new)
+
+def audit(engine, max_block: int = MAX_BLOCK, save: bool = True) -> list:
+    """
+    Compare the whole patient table for probable duplicates
+    Returns [(patient, patient, reasons)] with each patient as a dict of its
+    columns. If save, the flags from the last audit are replaced with these
+    """
+    index = PatientIndex(max_block)
+    index.load(engine)
+    pairs = list(index.pairs())
+    logging.info('Patient audit: {0} patients, {1} probable duplicates'.format(len(index.patients), len(pairs)))
+    if save:
+        t = db.PatientFlag.__table__
+        with engine.begin() as conn:
+            conn.execute(t.delete().where(t.c.source == 'audit'))
+            write_flags(conn, [flag(a, b, FLAG_DUPLICATE, ', '.join(reasons)) for a, b, reasons in pairs], 'audit')
+    return [(index.patients[a], index.patients[b], reasons) for a, b, reasons in pairs]
@@ -0,0 +1,448 @@
+# Batched writer - collects parsed records and inserts them in chunks
+
+import scripts.database.db as db
+from scripts.database.patients import PatientCache
+from scripts.database.reconcile import PatientIndex, write_flags
+from scripts.parsers.parsers import Parsetype
+from scripts.parsers.dates import parse_date
+from scripts.ingest.metrics import get_metrics
+from sqlalchemy import select, func, bindparam, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+import logging
+import time
+
+# Types of record the writer has tables for
+RECORD_TYPES = [Parsetype.PT_FULL_PFT, Parsetype.PT_NEW_OXI, Parsetype.PT_OLD_OXI, Parsetype.PT_RAD8]
+OXIMETRY_TYPES = [Parsetype.PT_NEW_OXI, Parsetype.PT_OLD_OXI, Parsetype.PT_RAD8]
+
+# Tables written by the writer, in insert order
+TABLES = [db.Spirometry, db.Lungfunc, db.Physiology, db.Oximetry]
+
+# Columns identifying a study in each table, matching its unique index -
+# oximetry from different devices on the same day are separate studies
+STUDY_KEYS = {db.Spirometry: ('subject_id', 'study_date'),
+              db.Lungfunc: ('subject_id', 'study_date'),
+              db.Physiology: ('subject_id', 'study_date'),
+              db.Oximetry: ('subject_id', 'study_date', 'device')}
+
+# Tables computed from the studies - rows for a study that is updated are
+# deleted so they are recomputed. Keyed per study, per patient or per month
+# The cohort summary's months are cleared for new studies too, which is how
+# its refresh finds the months to compute
+DEPENDENT_TABLES = {db.Derived: ('subject_id', 'study_date'),
+                    db.Trend: ('subject_id',),
+                    db.CohortSummary: ('month',)}
+
+# Parsed measures stored in the lungfunc table - a PFT report without any of
+# them was spirometry only
+LUNGFUNC_KEYS = ['TLco', 'VAsb', 'KCO', 'FRC', 'VC', 'TLC', 'RV', 'RV_TLC']
+
+# Tables the cohort summary is computed from
+SUMMARY_TABLES = [db.Spirometry, db.Lungfunc]
+
+# Most studies looked up in one query - keeps under SQLite's limit on bound
+# parameters
+LOOKUP_SIZE = 400
+
+class BatchWriter:
+    """
+    Collects parsed records and writes them to the database in chunks
+    Each chunk is one transaction of executemany inserts, so a commit is paid
+    once per chunk rather than once per report
+    Handles PFT reports (spirometry, lungfunc and physiology rows) and the
+    oximetry reports (oximetry rows)
+    A chunk is written when it reaches batch_size records, or when a record is
+    added more than max_seconds after the last write. flush() must be called
+    at the end of a run to write whatever is left
+    If writing a chunk fails only that chunk is rolled back
+    Each table holds one study per patient per date. A report for a study
+    that is already stored updates that row (only if something has changed)
+    rather than adding another, so importing the same reports again is safe
+    Primary keys are allocated here so rows can reference each other without
+    a round trip per insert - the writer must be the only thing adding rows to
+    these tables while it runs
+    Patients are resolved through a PatientCache, loaded on the first chunk if
+    load_patients() hasn't been called. A PatientIndex loaded alongside it
+    flags reports whose name, date of birth or sex disagree with the patient
+    their RXR belongs to, and new patients that look like an existing one -
+    see scripts/database/reconcile.py
+    """
+    def __init__(self, engine, batch_size: int = 500, max_seconds: float = 30.0):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_seconds = max_seconds
+        self.after_flush = None
+        self.patients = PatientCache()
+        self.index = PatientIndex()
+        self.new_patients = []
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+    def load_patients(self):
+        """
+        Preload the patient cache and index from the database
+        """
+        self.patients.load(self.engine)
+        self.index.load(self.engine)
+
+    def add(self, rec: dict, p: Parsetype, done = None, failed = None):
+        """
+        Queue a record of type p
+        done, if given, is called with the ids of the rows written for rec as
+        {table name: [ids]} once its chunk has been committed. rec may be None
+        to queue just the callback
+        failed, if given, is called with the exception if rec's values can't
+        be stored (e.g. a date or number that won't convert)
+        """
+        self.pending.append((rec, p, done, failed))
+        if len(self.pending) >= self.batch_size or \
+                time.monotonic() - self.last_flush >= self.max_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all queued records in a single transaction
+        """
+        self.last_flush = time.monotonic()
+        if len(self.pending) == 0:
+            return
+
+        chunk = self.pending
+        self.pending = []
+        self.new_patients = []
+        try:
+            # Date handling during the write is also counted in its own stage
+            with get_metrics().stage('db'), self.engine.begin() as conn:
+                results = self._write(conn, chunk)
+        except SQLAlchemyError:
+            logging.exception('Failed to write chunk of {0} records - chunk rolled back'.format(len(chunk)))
+            self.patients.discard(self.new_patients)
+            self.index.discard(self.new_patients)
+            return
+
+        # The chunk is committed, so one callback failing mustn't stop the
+        # others recording their files
+        for (_, _, done, failed), row_ids in zip(chunk, results):
+            try:
+                if isinstance(row_ids, Exception):
+                    if failed is not None:
+                        failed(row_ids)
+                elif done is not None and row_ids is not None:
+                    done(row_ids)
+            except Exception:
+                logging.exception('Failed to record a written record')
+        if self.after_flush is not None:
+            self.after_flush()
+
+    def _write(self, conn, chunk: list) -> list:
+        next_id = {t: self._max_id(conn, t) + 1 for t in \
+                   [db.Patient] + TABLES}
+        first_new_patient = next_id[db.Patient]
+        patients = self._get_patients(conn, chunk, next_id)
+
+        # Rows for each record, or the result to give it if there are none
+        chunk_rows = []
+        for rec, p, _, _ in chunk:
+            if rec is None:
+                chunk_rows.append(dict())
+                continue
+            if not 'RXR' in rec:
+                logging.error('Tried to add record with no RXR')
+                chunk_rows.append(dict())
+                continue
+
+            try:
+                rec_rows = record_rows(rec, p, patients[rec['RXR'].upper()])
+            except (ValueError, OverflowError, KeyError) as e:
+                logging.exception('Unable to add record for {0}'.format(rec['RXR']))
+                chunk_rows.append(e)
+                continue
+            if not p in RECORD_TYPES:
+                # Leave out of the manifest so it is read again once supported
+                chunk_rows.append(None)
+                continue
+            chunk_rows.append(rec_rows)
+
+        # New patients can't have stored studies
+        keys = {t: set() for t in TABLES}
+        for rec_rows in chunk_rows:
+            if isinstance(rec_rows, list):
+                for table, row in rec_rows:
+                    if row['study_date'] is not None and row['subject_id'] < first_new_patient:
+                        keys[table].add(study_key(table, row, None))
+        existing = self._existing_rows(conn, keys)
+
+        # Final row for each study, keyed by study_key() - a later report of
+        # the same study replaces an earlier one
+        rows = {t: dict() for t in TABLES}
+        results = []
+        for rec_rows in chunk_rows:
+            if not isinstance(rec_rows, list):
+                results.append(rec_rows)
+                continue
+
+            row_ids = dict()
+            for table, row in rec_rows:
+                key = study_key(table, row, next_id[table])
+                if key in rows[table]:
+                    row['id'] = rows[table][key]['id']
+                elif key in existing[table]:
+                    row['id'] = existing[table][key]['id']
+                else:
+                    row['id'] = next_id[table]
+                    next_id[table] += 1
+                if table is db.Lungfunc:
+                    row['spiro_id'] = row_ids['spirometry'][-1]
+                rows[table][key] = row
+                row_ids.setdefault(table.__tablename__, []).append(row['id'])
+            results.append(row_ids)
+
+        changed = set()
+        months = set()
+        for table in TABLES:
+            inserts = []
+            updates = []
+            for key, row in rows[table].items():
+                old = existing[table].get(key)
+                if old is None:
+                    inserts.append(row)
+                elif any(old[k] != v for k, v in row.items()):
+                    updates.append(row)
+                    changed.add((row['subject_id'], row['study_date']))
+                else:
+                    continue
+                if table in SUMMARY_TABLES and row['study_date'] is not None:
+                    months.add(row['study_date'].replace(day = 1))
+            if len(inserts) > 0:
+                conn.execute(table.__table__.insert(), inserts)
+            if len(updates) > 0:
+                self._update(conn, table, updates)
+        if len(changed) > 0 or len(months) > 0:
+            self._clear_dependent(conn, sorted(changed), sorted(months))
+
+        return results
+
+    def _clear_dependent(self, conn, keys: list, months: list):
+        """
+        Delete the computed rows for the updated studies keys, and the cohort
+        summaries for months with new or updated studies
+        """
+        subject_ids = sorted({sid for sid, _ in keys})
+        for table, key in DEPENDENT_TABLES.items():
+            t = table.__table__
+            if key == ('month',):
+                col, todo = t.c.month, months
+            elif len(key) == 1:
+                col, todo = t.c[key[0]], subject_ids
+            else:
+                col, todo = tuple_(*[t.c[k] for k in key]), keys
+            for i in range(0, len(todo), LOOKUP_SIZE):
+                conn.execute(t.delete().where(col.in_(todo[i:i + LOOKUP_SIZE])))
+
+    def _existing_rows(self, conn, keys: dict) -> dict:
+        """
+        Takes {table: set of study keys} and returns {table: {key: row}} for
+        the studies already stored, so re-imported reports update them in place
+        Looked up through the unique study indexes (see STUDY_KEYS)
+        """
+        existing = {t: dict() for t in TABLES}
+        for table in TABLES:
+            t = table.__table__
+            todo = sorted(keys[table])
+            for i in range(0, len(todo), LOOKUP_SIZE):
+                res = conn.execute(select(t).where(tuple_(*[t.c[c] for c in STUDY_KEYS[table]]) \
+                                                   .in_(todo[i:i + LOOKUP_SIZE])))
+                for row in res.mappings():
+                    existing[table][study_key(table, row, None)] = dict(row)
+        return existing
+
+    def _update(self, conn, table, rows: list):
+        """
+        Overwrite existing rows with new values - every row must have the same
+        columns
+        """
+        t = table.__table__
+        cols = [c for c in rows[0] if c != 'id']
+        stmt = t.update().where(t.c.id == bindparam('_id')) \
+            .values({c: bindparam('_' + c) for c in cols})
+        conn.execute(stmt, [{'_' + k: v for k, v in row.items()} for row in rows])
+
+    def _get_patients(self, conn, chunk: list, next_id: dict) -> dict:
+        """
+        Returns {rxr: patient id} for every RXR in chunk
+        New patients are inserted together and added to the cache
+        """
+        if not self.patients.loaded:
+            self.patients.load(conn)
+        if not self.index.loaded:
+            self.index.load(conn)
+
+        patients = dict()
+        new_rows = []
+        flags = []
+        for rec, _, _, _ in chunk:
+            if rec is None or not 'RXR' in rec:
+                continue
+            rxr = rec['RXR'].upper()
+            pid = self.patients.get(rxr)
+            if pid is not None:
+                patients[rxr] = pid
+                try:
+                    flags += self.index.check(pid, patient_row(rec))
+                except (ValueError, OverflowError):
+                    # Details that can't be read can't be compared
+                    pass
+                continue
+
+            try:
+                row = patient_row(rec)
+            except (ValueError, OverflowError):
+                logging.exception('Bad patient details for {0}'.format(rxr))
+                row = patient_row({'RXR': rxr})
+            row['id'] = next_id[db.Patient]
+            next_id[db.Patient] += 1
+            patients[rxr] = row['id']
+            self.patients.add(rxr, row['id'])
+            self.new_patients.append(rxr)
+            flags += self.index.check_new(row)
+            self.index.add(row)
+            new_rows.append(row)
+
+        if len(new_rows) > 0:
+            conn.execute(db.Patient.__table__.insert(), new_rows)
+        if len(flags) > 0:
+            write_flags(conn, flags, 'ingest')
+        return patients
+
+    def _max_id(self, conn, model) -> int:
+        t = model.__table__
+        res = conn.execute(select(func.max(t.c.id))).scalar()
+        return (res if res is not None else 0)
+
+def study_key(table, row: dict, new_id: int) -> tuple:
+    """
+    Key identifying a study - one row per table per patient per date (and
+    device, for oximetry), see STUDY_KEYS
+    Rows without a date can't be matched so each gets a key of its own
+    """
+    if row['study_date'] is None:
+        return ('new', new_id)
+    return tuple(row[c] for c in STUDY_KEYS[table])
+
+def patient_row(rec: dict) -> dict:
+    """
+    Column values for a new patient from a parsed record
+    """
+    with get_metrics().stage('dates'):
+        dob = (parse_date(rec['dob']) if 'dob' in rec else None)
+    return {'rxr': rec['RXR'].upper(),
+            'dob': dob,
+            'lname': (rec['lname'].lower().capitalize() if 'lname' in rec else None),
+            'fname': (rec['fname'].lower().capitalize() if 'fname' in rec else None),
+            'sex': (rec['sex'].lower().capitalize() if 'sex' in rec else None)}
+
+def record_rows(rec: dict, p: Parsetype, subject_id: int) -> list:
+    """
+    Takes a parsed record and returns a list of (model, column values) for the
+    rows it should add. A Lungfunc row always follows the Spirometry row it
+    belongs to
+    """
+    rows = []
+    with get_metrics().stage('dates'):
+        study_date = (parse_date(rec['date']) if 'date' in rec else None)
+
+    if 'height' in rec:
+        rows.append((db.Physiology, {'subject_id': subject_id,
+                                     'study_date': study_date,
+                                     'height': (float(rec['height']) if 'height' in rec else None),
+                                     'weight': (float(rec['weight']) if 'weight' in rec else None)}))
+
+    if p is Parsetype.PT_FULL_PFT:
+        spiro = {'subject_id': subject_id, 'study_date': study_date}
+
+        spiro['fev1_pre'], spiro['fev1_pred'], spiro['fev1_pre_percent_pred'], spiro['fev1_pre_SR'], \
+            spiro['fev1_post'], spiro['fev1_percent_change'], spiro['fev1_post_percent_pred'], \
+            spiro['fev1_post_SR'] = get_spiro_vals('FEV1', rec)
+
+        spiro['fvc_pre'], spiro['fvc_pred'], spiro['fvc_pre_percent_pred'], spiro['fvc_pre_SR'], \
+            spiro['fvc_post'], spiro['fvc_percent_change'], spiro['fvc_post_percent_pred'], \
+            spiro['fvc_post_SR'] = get_spiro_vals('FVC', rec)
+        rows.append((db.Spirometry, spiro))
+
+        # The parser sets every measure, empty if it isn't in the report
+        if any(rec.get(k) for k in LUNGFUNC_KEYS):
+            lung = {'subject_id': subject_id, 'study_date': study_date}
+
+            lung['tlco'], lung['tlco_pred'], lung['tlco_percent_pred'], \
+                lung['tlco_SR'] = get_pft_vals('TLco', rec)
+            lung['vasb'], lung['vasb_pred'], lung['vasb_percent_pred'], \
+                _ = get_pft_vals('VAsb', rec)
+            lung['kco'], lung['kco_pred'], lung['kco_percent_pred'], \
+                _ = get_pft_vals('KCO', rec)
+            lung['frc'], lung['frc_pred'], lung['frc_percent_pred'], \
+                lung['frc_SR'] = get_pft_vals('FRC', rec)
+            lung['vc'], lung['vc_pred'], lung['vc_percent_pred'], \
+                lung['vc_SR'] = get_pft_vals('VC', rec)
+            lung['tlc'], lung['tlc_pred'], lung['tlc_percent_pred'], \
+                lung['tlc_SR'] = get_pft_vals('TLC', rec)
+            lung['rv'], lung['rv_pred'], lung['rv_percent_pred'], \
+                lung['rv_SR'] = get_pft_vals('RV', rec)
+            lung['tlcrv'], lung['tlcrv_pred'], lung['tlcrv_percent_pred'], \
+                lung['tlcrv_SR'] = get_pft_vals('RV_TLC', rec)
+            rows.append((db.Lungfunc, lung))
+
+        else:
+            logging.info('{0}: Adding isolated spiro'.format(rec['RXR']))
+
+    elif p in OXIMETRY_TYPES:
+        rows.append((db.Oximetry, {'subject_id': subject_id,
+                                   'study_date': study_date,
+                                   'device': p.name,
+                                   'odi': (float(rec['odi']) if 'odi' in rec else None),
+                                   'hri': (float(rec['hri']) if 'hri' in rec else None),
+                                   'report': (rec['report'] if 'report' in rec else None)}))
+
+    else:
+        logging.error('No table for {0} records'.format(p.name if p is not None else p))
+
+    return rows
+
+def get_spiro_vals(key: str, rec: dict) -> tuple:
+    """
+    Takes a spirometry test (eg FEV1, FVC, etc) as key and returns an 8-tuple
+    with pre then post measured, %predicted, SR as well as predicted and percent change
+    Fills tuple position with None if value doesn't exist
+    """
+    if not key in rec:
+        logging.error('Lung function, get_spiro_vals() - no data found')
+        return (None, None, None, None, None, None, None, None)
+
+    pre = rec[key]['Measured_pre']
+    pred = rec[key]['Predicted']
+    pre_percent_pred = rec[key]['Percent_pred_pre']
+    pre_SR = (rec[key]['SR_pre'] if 'SR_pre' in rec[key] else None)
+
+    post = (rec[key]['Measured_post'] if 'Measured_post' in rec[key] else None)
+    post_percent_pred = (rec[key]['Percent_pred_post'] if 'Percent_pred_post' in rec[key] else None)
+    percent_change = (rec[key]['Percent_change'] if 'Percent_change' in rec[key] else None)
+    post_SR = (rec[key]['SR_post'] if 'SR_post' in rec[key] else None)
+
+    return (pre, pred, pre_percent_pred, pre_SR, post, percent_change, post_percent_pred, post_SR)
+
+def get_pft_vals(key: str, rec: dict) -> tuple:
+    """
+    Takes a lung function test (eg TLco, etc) as key and returns an 4-tuple
+    with measured, predicted, %predicted, SR
+    Fills tuple position with None if value doesn't exist
+    Use get_spiro_vals() for measures with reversibility
+    """
+    if not key in rec:
+        logging.error('Lung function, get_pft_vals() - no data found')
+        return (None, None, None, None)
+
+    measured = (rec[key]['Measured_pre'] if 'Measured_pre' in rec[key] else None)
+    pred = (rec[key]['Predicted'] if 'Predicted' in rec[key] else None)
+    percent = (rec[key]['Percent_pred_pre'] if 'Percent_pred_pre' in rec[key] else None)
+    sr = (rec[key]['SR_pre'] if 'SR_pre' in rec[key] else None)
+
+    return (measured, pred, percent, sr)
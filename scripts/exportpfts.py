@@ -0,0 +1,35 @@
+# Export lung function results for analysis
+import sys
+import os
+folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, folder)
+
+import argparse
+import logging
+
+from scripts.database.engine import Database, DB_URL_ENV, DEFAULT_DB_URL
+import scripts.analysis.export as export
+
+logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+
+def main():
+    ap = argparse.ArgumentParser(description='Export patient, spirometry, lung function and physiology ' \
+                                 'results as one row per study')
+    ap.add_argument('out', help='File to write')
+    ap.add_argument('--format', choices=export.FORMATS, default=None, \
+                    help='Output format (default from the file extension, parquet if not known)')
+    ap.add_argument('--chunk-size', type=int, default=export.DEFAULT_CHUNK, \
+                    help='Rows read and written at a time')
+    ap.add_argument('--db', default=None, metavar='URL', \
+                    help='Database url (default ${0} or {1})'.format(DB_URL_ENV, DEFAULT_DB_URL))
+    args = ap.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        ext = os.path.splitext(args.out)[1].lstrip('.').lower()
+        fmt = {'npz': 'npz', 'arrow': 'arrow', 'feather': 'arrow', 'ipc': 'arrow'}.get(ext, 'parquet')
+    n = export.export(Database(args.db).engine, args.out, fmt, args.chunk_size)
+    print('{0} rows written to {1}'.format(n, args.out))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# Ingest run instrumentation - stage timers, outcome counters, slowest files
+
+from contextlib import contextmanager, nullcontext
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+# Environment variable turning metrics on - set by scanpfts.py --metrics so
+# pool workers time their stages too
+METRICS_ENV = 'LUNGDB_METRICS'
+
+# Stages timed during a run, in pipeline order
+STAGES = ['walk', 'fingerprint', 'extract', 'parse', 'dates', 'db']
+
+# Returned by stage() when metrics are off, so timing a stage costs one call
+_NULL = nullcontext()
+
+class Metrics:
+    """
+    Totals for an ingest run: seconds spent in each stage, counts of files by
+    outcome and the slowest files
+    Time is added with stage(), which does nothing unless enabled. Between
+    begin_file() and end_file() a thread's stage times are collected for that
+    file instead of added to the totals, so a pool worker can return them with
+    its result to be merged in the main process with add_file()
+    """
+    def __init__(self, enabled: bool = False, top: int = 10):
+        self.enabled = enabled
+        self.top = top
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.seconds = {s: 0.0 for s in STAGES}
+        self.counts = dict()
+        self.slowest = []
+
+    def stage(self, name: str):
+        """
+        Context manager timing a stage, e.g. with metrics.stage('extract'):
+        """
+        if not self.enabled:
+            return _NULL
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        current = getattr(self.local, 'current', None)
+        if current is not None:
+            current[name] = current.get(name, 0.0) + seconds
+            return
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def count(self, name: str, label: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counts[(name, label)] = self.counts.get((name, label), 0) + n
+
+    def begin_file(self):
+        if self.enabled:
+            self.local.current = {'_start': time.perf_counter()}
+
+    def end_file(self) -> dict:
+        """
+        Returns {stage: seconds} for the file since begin_file(), with its
+        total time as 'file', or None if metrics are off
+        """
+        current = getattr(self.local, 'current', None)
+        if current is None:
+            return None
+        self.local.current = None
+        current['file'] = time.perf_counter() - current.pop('_start')
+        return current
+
+    def add_file(self, f, stats: dict):
+        """
+        Merge the stage times returned by end_file() for file f
+        """
+        if not self.enabled or stats is None:
+            return
+        with self.lock:
+            for name, seconds in stats.items():
+                if name != 'file':
+                    self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            item = (stats['file'], str(f))
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, item)
+            elif item > self.slowest[0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def summary(self) -> dict:
+        with self.lock:
+            counts = dict()
+            for (name, label), n in sorted(self.counts.items()):
+                counts.setdefault(name, dict())[label] = n
+            return {'started': self.started,
+                    'elapsed': time.time() - self.started,
+                    'stage_seconds': {k: round(v, 6) for k, v in self.seconds.items()},
+                    'counts': counts,
+                    'slowest': [{'file': f, 'seconds': round(s, 6)} for s, f in \
+                                sorted(self.slowest, reverse = True)]}
+
+    def write_json(self, path: str):
+        _write_atomic(path, json.dumps(self.summary(), indent = 2))
+
+    def write_prometheus(self, path: str):
+        """
+        Write the totals in Prometheus text format, for node_exporter's
+        textfile collector
+        """
+        s = self.summary()
+        lines = ['# HELP lungdb_ingest_stage_seconds Time spent in each ingest stage during the last run',
+                 '# TYPE lungdb_ingest_stage_seconds gauge']
+        lines += ['lungdb_ingest_stage_seconds{{stage="{0}"}} {1}'.format(k, v) \
+                  for k, v in s['stage_seconds'].items()]
+        for name, labels in s['counts'].items():
+            lines += ['# HELP lungdb_ingest_{0}_files Files by {0} during the last run'.format(name),
+                      '# TYPE lungdb_ingest_{0}_files gauge'.format(name)]
+            lines += ['lungdb_ingest_{0}_files{{{0}="{1}"}} {2}'.format(name, k, v) for k, v in labels.items()]
+        lines += ['# HELP lungdb_ingest_elapsed_seconds Wall time of the last run',
+                  '# TYPE lungdb_ingest_elapsed_seconds gauge',
+                  'lungdb_ingest_elapsed_seconds {0}'.format(round(s['elapsed'], 3)),
+                  '# HELP lungdb_ingest_last_run_timestamp_seconds When the last run started',
+                  '# TYPE lungdb_ingest_last_run_timestamp_seconds gauge',
+                  'lungdb_ingest_last_run_timestamp_seconds {0}'.format(round(s['started'], 3))]
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+    def log_summary(self):
+        s = self.summary()
+        logging.info('Stage seconds: {0}'.format(', '.join('{0} {1:.2f}'.format(k, v) \
+                                                        for k, v in s['stage_seconds'].items())))
+        for name, labels in s['counts'].items():
+            logging.info('Files by {0}: {1}'.format(name, labels))
+        for item in s['slowest']:
+            logging.info('Slow file: {0} {1:.2f}s'.format(item['file'], item['seconds']))
+
+def _write_atomic(path: str, text: str):
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+_metrics = None
+
+def get_metrics() -> Metrics:
+    """
+    Returns the process's Metrics, enabled if $LUNGDB_METRICS is set to
+    anything but an empty string or 0
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics(os.environ.get(METRICS_ENV, '') not in ['', '0'])
+    return _metrics
+
+def reset(enabled: bool, top: int = 10) -> Metrics:
+    """
+    Start a new set of totals for a run
+    """
+    global _metrics
+    _metrics = Metrics(enabled, top)
+    return _metrics
@@ -0,0 +1,165 @@
+# Staged ingest pipeline - file walker, parsing pool and a single db writer
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+import threading
+import queue
+import logging
+
+# Marks the end of the work on a queue
+_END = object()
+
+class Pipeline:
+    """
+    Runs the stages of an ingest concurrently:
+        walker thread - iterates over the files to read
+        parse stage - calls parse(f) for each file, in a process pool if
+            workers > 1, otherwise in the calling thread
+        writer thread - calls store(f, result) for each file in walk order,
+            then finish() once everything is stored. All database work should
+            happen in store() and finish() so one thread owns the session
+    The stages are linked by queues of at most queue_size items and the pool
+    has at most 2 * workers files in flight, so memory use stays the same
+    however many files there are - a slow stage holds up the ones before it
+    If a worker process dies, the file being waited on is retried on its own
+    and crash_result is stored for it if it kills that worker too
+    """
+    def __init__(self, parse, store, finish = None, workers: int = 1, \
+                 queue_size: int = 100, crash_result = None):
+        self.parse = parse
+        self.store = store
+        self.finish = finish
+        self.workers = workers
+        self.queue_size = queue_size
+        self.crash_result = crash_result
+        self.errors = []
+
+    def run(self, files):
+        """
+        Process files (any iterable, consumed lazily) through the pipeline
+        Returns once every result has been stored
+        """
+        todo = queue.Queue(maxsize = self.queue_size)
+        done = queue.Queue(maxsize = self.queue_size)
+        walker = threading.Thread(target = self._walk, args = (files, todo), \
+                                  name = 'ingest-walker', daemon = True)
+        writer = threading.Thread(target = self._write, args = (done,), name = 'ingest-writer')
+        walker.start()
+        writer.start()
+        try:
+            if self.workers > 1:
+                self._parse_pool(todo, done)
+            else:
+                for f in iter(todo.get, _END):
+                    done.put((f, self.parse(f)))
+        finally:
+            done.put(_END)
+            writer.join()
+        walker.join()
+
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+    def _walk(self, files, todo: queue.Queue):
+        try:
+            for f in files:
+                todo.put(f)
+        except Exception as e:
+            logging.exception('Ingest walker failed')
+            self.errors.append(e)
+        finally:
+            todo.put(_END)
+
+    def _write(self, done: queue.Queue):
+        failed = False
+        for f, res in iter(done.get, _END):
+            if failed:
+                continue
+            try:
+                self.store(f, res)
+            except Exception as e:
+                # Keep draining the queue so the other stages can finish
+                logging.exception('Ingest writer failed on {0}'.format(f))
+                self.errors.append(e)
+                failed = True
+
+        if self.finish is not None:
+            try:
+                self.finish()
+            except Exception as e:
+                logging.exception('Ingest writer failed to finish')
+                self.errors.append(e)
+
+    def _parse_pool(self, todo: queue.Queue, done: queue.Queue):
+        inflight = deque()
+        pool = ProcessPoolExecutor(max_workers = self.workers)
+        try:
+            for f in iter(todo.get, _END):
+                try:
+                    fut = pool.submit(self.parse, f)
+                except BrokenProcessPool:
+                    # A worker died after the oldest file finished
+                    pool = self._restart(pool, inflight)
+                    fut = self._submit(pool, f)
+                inflight.append((f, fut))
+                if len(inflight) >= 2 * self.workers:
+                    pool = self._collect(inflight, done, pool)
+            while len(inflight) > 0:
+                pool = self._collect(inflight, done, pool)
+        finally:
+            pool.shutdown()
+
+    def _collect(self, inflight: deque, done: queue.Queue, pool: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """
+        Wait for the oldest file in flight and pass its result to the writer
+        Returns the pool to carry on with, which is a new one if it broke
+        """
+        f, fut = inflight.popleft()
+        try:
+            res = fut.result()
+        except BrokenProcessPool:
+            res = self._parse_isolated(f)
+            pool = self._restart(pool, inflight)
+        done.put((f, res))
+        return pool
+
+    def _restart(self, pool: ProcessPoolExecutor, inflight: deque) -> ProcessPoolExecutor:
+        """
+        Replace a broken pool with a new one and resubmit the files in flight
+        Files that finished before the pool broke keep their results
+        """
+        pool.shutdown(wait = False)
+        pool = ProcessPoolExecutor(max_workers = self.workers)
+        resubmit = list(inflight)
+        inflight.clear()
+        for g, gfut in resubmit:
+            if gfut.done() and not isinstance(gfut.exception(), BrokenProcessPool):
+                inflight.append((g, gfut))
+            else:
+                inflight.append((g, self._submit(pool, g)))
+        return pool
+
+    def _submit(self, pool: ProcessPoolExecutor, f) -> Future:
+        """
+        Submit f to the pool. If the pool has already broken again the future
+        fails with BrokenProcessPool, for _collect() to deal with
+        """
+        try:
+            return pool.submit(self.parse, f)
+        except BrokenProcessPool as e:
+            fut = Future()
+            fut.set_exception(e)
+            return fut
+
+    def _parse_isolated(self, f):
+        """
+        Parse a single file in its own worker process
+        Used after a pool failure to find out whether f was the cause
+        """
+        try:
+            with ProcessPoolExecutor(max_workers = 1) as pool:
+                return pool.submit(self.parse, f).result()
+        except BrokenProcessPool:
+            logging.error('Worker process died parsing {0}'.format(f))
+            return self.crash_result
@@ -0,0 +1,93 @@
+# Directory walker - yields the files to ingest as they are found
+
+import os
+import logging
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+# What to do with symbolic links
+SYMLINKS_SKIP = 'skip'      # ignore all links
+SYMLINKS_FILES = 'files'    # read linked files but don't descend into linked directories
+SYMLINKS_FOLLOW = 'follow'  # follow everything - each directory is only read once
+SYMLINK_POLICIES = [SYMLINKS_SKIP, SYMLINKS_FILES, SYMLINKS_FOLLOW]
+
+DEFAULT_INCLUDE = ('*.pdf',)
+DEFAULT_EXCLUDE = ('*TREND*',)
+
+def walk(root: Path, include: tuple = DEFAULT_INCLUDE, exclude: tuple = DEFAULT_EXCLUDE, \
+         max_depth: int = None, symlinks: str = SYMLINKS_FOLLOW, modified_since: float = None, \
+         on_dir = None):
+    """
+    Generator yielding the files under root, one directory listing at a time,
+    so the first file can be processed before the rest of the tree is read
+    include - glob patterns, a file is yielded if its name matches any of them
+    exclude - glob patterns matched against the path relative to root; matching
+        files are skipped and matching directories are not entered
+    max_depth - how many levels of subdirectory to enter, None for no limit
+    symlinks - one of SYMLINK_POLICIES
+    modified_since - if set, only files with an mtime at or after this
+        timestamp are yielded
+    on_dir - if set, called with each directory as it is read
+    Within a directory files come first, then subdirectories, each in sorted
+    order, so repeat walks see the same sequence
+    """
+    if not symlinks in SYMLINK_POLICIES:
+        raise ValueError('Unknown symlink policy: {0}'.format(symlinks))
+    seen = set()
+    yield from _walk(Path(root), '', 0, include, exclude, max_depth, symlinks, modified_since, seen, on_dir)
+
+def is_wanted(root: Path, f: Path, include: tuple = DEFAULT_INCLUDE, exclude: tuple = DEFAULT_EXCLUDE) -> bool:
+    """
+    True if walk(root) with these patterns would yield f - for checking a
+    single file without walking the whole tree
+    """
+    try:
+        parts = Path(f).relative_to(root).parts
+    except ValueError:
+        return False
+    if not any(fnmatchcase(parts[-1], pat) for pat in include):
+        return False
+    return not any(fnmatchcase('/'.join(parts[:i]), pat) for i in range(1, len(parts) + 1) for pat in exclude)
+
+def _walk(d: Path, rel: str, depth: int, include: tuple, exclude: tuple, max_depth: int, \
+          symlinks: str, modified_since: float, seen: set, on_dir):
+    try:
+        st = d.stat()
+        if (st.st_dev, st.st_ino) in seen:
+            return
+        seen.add((st.st_dev, st.st_ino))
+        with os.scandir(d) as it:
+            entries = sorted(it, key = lambda e: e.name)
+    except OSError as e:
+        logging.error('Unable to read directory {0}: {1}'.format(d, e))
+        return
+    if on_dir is not None:
+        on_dir(d)
+
+    logging.info('Reading {0}'.format(d.name))
+    subdirs = []
+    for e in entries:
+        path = rel + e.name
+        if any(fnmatchcase(path, pat) for pat in exclude):
+            continue
+        try:
+            link = e.is_symlink()
+            if link and symlinks == SYMLINKS_SKIP:
+                continue
+            if e.is_dir():
+                if not (link and symlinks == SYMLINKS_FILES):
+                    subdirs.append((e, path))
+            elif e.is_file():
+                if not any(fnmatchcase(e.name, pat) for pat in include):
+                    continue
+                if modified_since is not None and e.stat().st_mtime < modified_since:
+                    continue
+                yield Path(e.path)
+        except OSError as err:
+            logging.error('Unable to read {0}: {1}'.format(e.path, err))
+
+    if max_depth is not None and depth >= max_depth:
+        return
+    for e, path in subdirs:
+        yield from _walk(Path(e.path), path + '/', depth + 1, include, exclude, max_depth, \
+                         symlinks, modified_since, seen, on_dir)
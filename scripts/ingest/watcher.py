@@ -0,0 +1,242 @@
+# Folder watcher - yields new and changed files once they have been written
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+import scripts.ingest.walker as walker
+
+# inotify event flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+_EVENT = struct.Struct('iIII')
+
+# A pdf ends with this marker (possibly followed by a newline) - a file
+# without one near the end is probably still being copied
+PDF_EOF = b'%%EOF'
+PDF_TAIL = 1024
+
+class Inotify:
+    """
+    Minimal inotify binding through libc, so no extra package is needed
+    Raises OSError if inotify isn't available (e.g. not on Linux)
+    """
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not supported on this system')
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.dirs = dict()
+        self.watched = set()
+
+    def add(self, d: Path):
+        """
+        Watch directory d (not its subdirectories) - a directory already
+        watched is ignored
+        """
+        if d in self.watched:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            logging.error('Unable to watch {0}: {1}'.format(d, os.strerror(err)))
+            return
+        self.dirs[wd] = d
+        self.watched.add(d)
+
+    def read(self, timeout: float) -> list:
+        """
+        Waits up to timeout seconds for events and returns them as a list of
+        (path, mask). path is None if the kernel's queue overflowed and events
+        were lost
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        i = 0
+        while i < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, i)
+            name = data[i + _EVENT.size:i + _EVENT.size + length].rstrip(b'\0')
+            i += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif mask & IN_IGNORED:
+                # Directory removed - the kernel drops the watch
+                d = self.dirs.pop(wd, None)
+                self.watched.discard(d)
+            elif wd in self.dirs:
+                events.append((self.dirs[wd] / os.fsdecode(name), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher:
+    """
+    Watches directories for new and changed files and hands them over once
+    they look complete
+    roots - directories to watch
+    settle - seconds a file must go unmodified before it is taken to be
+        complete. A pdf without an end of file marker is held for up to ten
+        times as long in case it is still being copied
+    interval - seconds between walks of the directories when polling
+    rescan - seconds between walks when using inotify, to catch anything it
+        missed (None never)
+    use_inotify - use inotify where available, otherwise poll
+    walk_opts - passed on to walker.walk(), so the same files are picked up as
+        by a scan
+    Files are tracked by (size, mtime) so each version of a file is handed
+    over once. Every file present on the first walk is handed over, for the
+    caller to check against the ingest manifest
+    """
+    def __init__(self, roots: list, settle: float = 2.0, interval: float = 5.0, rescan: float = 600.0, \
+                 use_inotify: bool = True, **walk_opts):
+        self.roots = [Path(r) for r in roots]
+        self.settle = settle
+        self.interval = interval
+        self.rescan = rescan
+        self.walk_opts = walk_opts
+        self.include = walk_opts.get('include', walker.DEFAULT_INCLUDE)
+        self.exclude = walk_opts.get('exclude', walker.DEFAULT_EXCLUDE)
+        self.known = dict()
+        self.pending = dict()
+        self.running = True
+
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, TypeError, AttributeError) as e:
+                logging.info('inotify not available: {0}'.format(e))
+        if self.inotify is None:
+            logging.info('Polling for new files every {0}s'.format(interval))
+
+    def stop(self):
+        """
+        Ends batches() - it returns after the wait in progress
+        """
+        self.running = False
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def batches(self):
+        """
+        Generator yielding lists of files ready to read, until stop() is called
+        """
+        last_walk = None
+        while self.running:
+            now = time.monotonic()
+            ready = []
+            if last_walk is None or now - last_walk >= self._walk_every():
+                seen = set()
+                for f in self._walk():
+                    seen.add(f)
+                    self._check(f, now, ready)
+                # Forget deleted files, so they are read again if they come back
+                for f in [f for f in self.known if not f in seen]:
+                    del self.known[f]
+                last_walk = now
+            for f in list(self.pending):
+                if not f in ready:
+                    self._check(f, now, ready)
+            if len(ready) > 0:
+                yield ready
+
+            # Wake at least every interval so stop() is noticed
+            timeout = (self.settle / 2 if len(self.pending) > 0 else self.interval)
+            timeout = max(0.0, min(timeout, last_walk + self._walk_every() - time.monotonic()))
+            if self.inotify is None:
+                time.sleep(timeout)
+                continue
+            for path, mask in self.inotify.read(timeout):
+                if path is None:
+                    logging.warning('inotify queue overflowed - rescanning')
+                    last_walk = None
+                elif mask & IN_ISDIR:
+                    # New or moved in directory - walk everything to watch it
+                    # and pick up its files
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        last_walk = None
+                elif not path in self.pending and self._is_wanted(path):
+                    self.pending[path] = (None, time.monotonic())
+
+    def _walk_every(self) -> float:
+        if self.inotify is None:
+            return self.interval
+        return (self.rescan if self.rescan is not None else float('inf'))
+
+    def _walk(self):
+        on_dir = (self.inotify.add if self.inotify is not None else None)
+        for root in self.roots:
+            yield from walker.walk(root, on_dir = on_dir, **self.walk_opts)
+
+    def _is_wanted(self, f: Path) -> bool:
+        return any(walker.is_wanted(root, f, self.include, self.exclude) for root in self.roots)
+
+    def _check(self, f: Path, now: float, ready: list):
+        """
+        Adds f to ready if it is new or changed and has stopped changing
+        """
+        try:
+            st = f.stat()
+        except OSError:
+            self.pending.pop(f, None)
+            return
+        fp = (st.st_size, st.st_mtime)
+        if self.known.get(f) == fp:
+            self.pending.pop(f, None)
+            return
+
+        last = self.pending.get(f)
+        if last is None or last[0] != fp:
+            # First sight of this version - a file that was last written
+            # a while ago is ready now
+            last = (fp, now)
+            self.pending[f] = last
+        waited = max(now - last[1], time.time() - st.st_mtime)
+        if waited < self.settle:
+            return
+        if waited < 10 * self.settle and not is_complete(f):
+            return
+        self.known[f] = fp
+        del self.pending[f]
+        ready.append(f)
+
+def is_complete(f: Path) -> bool:
+    """
+    False for a pdf that doesn't end with an end of file marker. Other files
+    are assumed to be complete
+    """
+    if f.suffix.lower() != '.pdf':
+        return True
+    try:
+        with open(f, 'rb') as fh:
+            fh.seek(max(0, fh.seek(0, os.SEEK_END) - PDF_TAIL))
+            return PDF_EOF in fh.read()
+    except OSError:
+        return False
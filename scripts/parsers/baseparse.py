@@ -1,6 +1,8 @@
 # Base class for various report parsers
 
-from tika import parser
+import scripts.parsers.textextract as textextract
+import scripts.parsers.textcache as textcache
+from scripts.ingest.metrics import get_metrics
 from os import path # Replace with pathlib?
 from pathlib import Path
 from enum import Enum, unique, auto
@@ -15,14 +17,49 @@ class ParseError(Enum):
     PARSE_NOT_EXTRACTED_YET = auto()
     PARSE_PARTIAL_EXTRACT = auto()
 
+def read_text(source_file: str, extractor: textextract.TextExtractor = None) -> str:
+    """
+    Returns the text of a pdf using extractor, or the default backend if None
+    The text cache is checked first, so unchanged files are only extracted once
+    """
+    if extractor is None:
+        extractor = textextract.get_extractor()
+    with get_metrics().stage('extract'):
+        cache = textcache.get_text_cache()
+        if cache is None:
+            return extractor.get_text(source_file)
+
+        digest = textcache.file_hash(source_file)
+        text = cache.get(digest, extractor.name)
+        if text is None:
+            text = extractor.get_text(source_file)
+            cache.put(digest, extractor.name, text)
+        return text
+
 class BaseParse:
-    def __init__(self, file: Path):
+    # Simple fields for _extract_fields(), declared by subclasses as a list of
+    # (key, regex, group) - the patterns are compiled once per class
+    fields = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compiled_fields = [(key, re.compile(regex), group) for key, regex, group in cls.fields]
+
+    def __init__(self, file: Path, extractor: textextract.TextExtractor = None, text: str = None):
+        """
+        Reads the text of file using extractor - if None the backend is chosen
+        by textextract.get_extractor()
+        If the text has already been read it can be passed in instead
+        """
         self.extracted = dict()
+        self.messages = []
         # May need to find as_posix() alternative for windows!
         self.source_file = file.resolve().as_posix()
-        if file.exists():
-            data = parser.from_file(self.source_file)
-            self.text = data['content']
+        if text is not None:
+            self.text = text
+            self.error_code = ParseError.PARSE_NOT_EXTRACTED_YET
+        elif file.exists():
+            self.text = read_text(self.source_file, extractor)
             self.error_code = ParseError.PARSE_NOT_EXTRACTED_YET
         else:
             self.error_code = ParseError.PARSE_NO_FILE
@@ -40,8 +77,17 @@ class BaseParse:
         else:
             return False
 
+    def _extract_fields(self):
+        """
+        Extract every field declared in the class's fields list
+        """
+        for key, regex, group in self._compiled_fields:
+            self._add_match(key, regex.search(self.text), group)
+
     def _add_extract(self, key: str, regex: str, group: int):
-        result = re.compile(regex).search(self.text)
+        self._add_match(key, re.compile(regex).search(self.text), group)
+
+    def _add_match(self, key: str, result, group: int):
         if result is None:
             self._log('Unable to extract \"{0}\" from {1}\n'.format(key, self.source_file))
             self.error_code = ParseError.PARSE_CANT_EXTRACT        
@@ -49,6 +95,7 @@ class BaseParse:
             self.extracted[key] = result.group(group)
 
     def _log(self, msg: str):
+        self.messages.append(msg)
         logging.warning(msg)
 
     def get_data(self) -> dict:
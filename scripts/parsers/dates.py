@@ -0,0 +1,37 @@
+# Parsing of the dates found in reports
+
+from functools import lru_cache
+from dateutil import parser as dtparser
+import datetime as dt
+import re
+
+# The reports write dates as day/month/year with /, \, . or : between the
+# parts - the same shape as the \d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4} regexes
+# in the parsers
+re_report_date = re.compile(r'^\s*(\d{1,2})[\\/\.:](\d{1,2})[\\/\.:](\d{2}|\d{4})\s*$')
+
+@lru_cache(maxsize = 8192)
+def parse_date(s: str) -> dt.date:
+    """
+    Convert a date string from a report to a date
+    Day first dates in the report formats are converted directly; anything
+    else is tried as an ISO date and then passed to dateutil (also day first)
+    Two digit years are taken to be in this century unless that would put
+    the date in the future
+    Results are memoized, so dates repeated across reports (eg dob) are only
+    parsed once. Raises ValueError if s isn't a valid date
+    """
+    m = re_report_date.match(s)
+    if m is None:
+        try:
+            return dt.date.fromisoformat(s.strip())
+        except ValueError:
+            return dtparser.parse(s, dayfirst = True).date()
+
+    day, month, year = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    if year < 100:
+        d = dt.date(2000 + year, month, day)
+        if d > dt.date.today():
+            d = dt.date(1900 + year, month, day)
+        return d
+    return dt.date(year, month, day)
@@ -1,25 +1,30 @@
 # Read oximetry - report generated from new device
 
 import scripts.parsers.baseparse as baseparse
+from scripts.parsers.textextract import TextExtractor
 from pathlib import Path
 import re
 
 class NewOxiParse(baseparse.BaseParse):
-    def __init__(self, file: Path):
-        super().__init__(file)
+    fields = [('RXR', r'Index Number:[\s]*(((rxr)|(RXR))(\d){7})', 1),
+              ('dob', r'Date of Birth:[\s]*(\d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4})', 1),
+              ('date', r'Date of Study:[\s]*(\d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4})', 1),
+
+              ('odi', r'Dips/Hr:[\s]*(\d{1,3}\.?\d{0,2})', 1),
+              ('hri', r'Rises/Hr:[\s]*(\d{1,3}\.?\d{0,2})', 1)]
+
+    re_name = re.compile(r'Patient Name:[\s]*([A-Za-z]+)[\s]*,[\s]*([A-Za-z]+)')
+
+    def __init__(self, file: Path, extractor: TextExtractor = None, text: str = None):
+        super().__init__(file, extractor, text)
 
         if self.error_code is baseparse.ParseError.PARSE_NOT_EXTRACTED_YET:
             self.extract() 
 
     def extract(self):
-        self._add_extract('RXR', r'Index Number:[\s]*(((rxr)|(RXR))(\d){7})', 1)
-        self._add_extract('dob', r'Date of Birth:[\s]*(\d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4})', 1)
-        self._add_extract('date', r'Date of Study:[\s]*(\d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4})', 1)
-
-        self._add_extract('odi', r'Dips/Hr:[\s]*(\d{1,3}\.?\d{0,2})', 1)
-        self._add_extract('hri', r'Rises/Hr:[\s]*(\d{1,3}\.?\d{0,2})', 1)
+        self._extract_fields()
 
-        re_name = re.compile(r'Patient Name:[\s]*([A-Za-z]+)[\s]*,[\s]*([A-Za-z]+)').search(self.text)
+        re_name = self.re_name.search(self.text)
         if re_name is None:
             self._log('No name extracted from {0}\n'.format(self.source_file))
             self.error_code = baseparse.ParseError.PARSE_CANT_EXTRACT
@@ -1,8 +1,75 @@
 # List of available parsers as enum
 
 from enum import Enum, unique, auto
+from pathlib import Path
+import re
+import logging
+
+import scripts.parsers.baseparse as baseparse
+from scripts.parsers.textextract import TextExtractor
+from scripts.ingest.metrics import get_metrics
+from scripts.parsers.pft import PFTParse
+from scripts.parsers.newoxi import NewOxiParse
+from scripts.parsers.oldoxi import OldOxiParse
+from scripts.parsers.rad8 import Rad8Parse
 
 @unique
 class Parsetype(Enum):
     PT_FULL_PFT = auto()
+    PT_NEW_OXI = auto()
+    PT_OLD_OXI = auto()
+    PT_RAD8 = auto()
+
+PARSERS = {Parsetype.PT_FULL_PFT: PFTParse,
+           Parsetype.PT_NEW_OXI: NewOxiParse,
+           Parsetype.PT_OLD_OXI: OldOxiParse,
+           Parsetype.PT_RAD8: Rad8Parse}
+
+# Header markers identifying each type of report, all must be on the first page
+# Checked in order - the old oximetry export has both oximeters' markers
+FINGERPRINTS = [(Parsetype.PT_FULL_PFT, [re.compile(r'Patient ID:')]),
+                (Parsetype.PT_RAD8, [re.compile(r'Hospital[\s]*number:')]),
+                (Parsetype.PT_OLD_OXI, [re.compile(r'Index Number:'), re.compile(r'Average Dips/Hour:')]),
+                (Parsetype.PT_NEW_OXI, [re.compile(r'Index Number:'), re.compile(r'Dips/Hr:')])]
+
+# Non-blank lines taken as the first page - more than a page of a report holds.
+# pdfminer separates pages with form feeds but Tika's text has no page breaks,
+# so the first page is cut at whichever comes first
+FIRST_PAGE_LINES = 100
+
+def first_page(text: str) -> str:
+    """
+    The start of text where the report header markers are looked for
+    """
+    lines = [l for l in text.split('\f', 1)[0].splitlines() if l.strip() != '']
+    return '\n'.join(lines[:FIRST_PAGE_LINES])
+
+def classify(text: str) -> Parsetype:
+    """
+    Work out the type of a report from the markers on its first page (see
+    first_page())
+    Returns None if it doesn't look like any known report
+    """
+    first = first_page(text)
+    for p, markers in FINGERPRINTS:
+        if all(m.search(first) is not None for m in markers):
+            return p
+    return None
+
+def parse_file(f: Path, p: Parsetype = None, extractor: TextExtractor = None) -> tuple:
+    """
+    Read the text of f once and parse it
+    If p is None the parser is chosen with classify()
+    Returns (parser type, parser object) - both None if the type isn't known
+    """
+    if not f.exists():
+        logging.error('Can\'t read file: {0}'.format(f))
+        return (p, (PARSERS[p](f) if p is not None else None))
 
+    text = baseparse.read_text(f.resolve().as_posix(), extractor)
+    with get_metrics().stage('parse'):
+        if p is None:
+            p = classify(text)
+            if p is None:
+                return (None, None)
+        return (p, PARSERS[p](f, extractor, text))
@@ -1,12 +1,39 @@
 # Parser for full PFT report
 
 import scripts.parsers.baseparse as baseparse
+from scripts.parsers.textextract import TextExtractor
 from pathlib import Path
 import re
 
 class PFTParse(baseparse.BaseParse):
-    def __init__(self, file: Path):
-        super().__init__(file)
+    fields = [('RXR', r'Patient ID:[\s]*(((rxr)|(RXR))(\d){7})', 1),
+              ('date', r'Study Date:[\s]*(\d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4})', 1),
+              ('dob', r'Birth Date:[\s]*(\d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4})', 1),
+
+              ('height', r'Height: (\d{2,3}(\.\d)?) cm', 1),
+              ('weight', r'Weight: (\d{2,3}(\.\d)?) kg', 1),
+
+              ('lname', r'Last Name:[\s]*([A-Za-z]+)', 1),
+              ('fname', r'First Name:[\s]*([A-Za-z]+)', 1),
+
+              ('sex', r'Gender:[\s]*((Male)|(MALE)|(Female)|(FEMALE))', 1)]
+
+    # Rows of the results table - leading label: key in extracted
+    lung_func = {'FEV1': 'FEV1',
+                 'FVC': 'FVC',
+                 'TLco': 'TLco',
+                 'VAsb': 'VAsb',
+                 'KCO': 'KCO',
+                 'FRC': 'FRC',
+                 'VC': 'VC',
+                 'TLC': 'TLC',
+                 'RV': 'RV',
+                 'RV/TLC': 'RV_TLC'
+                 }
+    re_values = re.compile(r'(-?\d{1,3}\.?\d{0,2})')
+
+    def __init__(self, file: Path, extractor: TextExtractor = None, text: str = None):
+        super().__init__(file, extractor, text)
 
         if self.error_code is baseparse.ParseError.PARSE_NOT_EXTRACTED_YET:
             self.extract()
@@ -17,55 +44,49 @@ class PFTParse(baseparse.BaseParse):
             if len(self.extracted) > 0:
                 self.error_code = baseparse.ParseError.PARSE_PARTIAL_EXTRACT 
 
-    def extract(self):
-        self._add_extract('RXR', r'Patient ID:[\s]*(((rxr)|(RXR))(\d){7})', 1)
-        self._add_extract('date', r'Study Date:[\s]*(\d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4})', 1)
-        self._add_extract('dob', r'Birth Date:[\s]*(\d{1,2}[\\/\.:]\d{1,2}[\\/\.:]\d{2,4})', 1)
-
-        self._add_extract('height', r'Height: (\d{2,3}(\.\d)?) cm', 1)
-        self._add_extract('weight', r'Weight: (\d{2,3}(\.\d)?) kg', 1)
-
-        self._add_extract('lname', r'Last Name:[\s]*([A-Za-z]+)', 1)
-        self._add_extract('fname', r'First Name:[\s]*([A-Za-z]+)', 1)
-
-        self._add_extract('sex', r'Gender:[\s]*((Male)|(MALE)|(Female)|(FEMALE))', 1)
+        # A study is stored from its spirometry - a report without FEV1 and
+        # FVC results can't be stored at all, whatever else was read
+        if self.is_any_data() and not (self.extracted.get('FEV1') and self.extracted.get('FVC')):
+            self.error_code = baseparse.ParseError.PARSE_CANT_EXTRACT
 
-        lung_func = {'FEV1': r'FEV1.*',
-                     'FVC': r'FVC.*',
-                     'TLco': r'TLco.*',
-                     'VAsb': r'VAsb.*',
-                     'KCO': r'KCO.*',
-                     'FRC': r'FRC.*',
-                     'VC': r'(?<!F)VC.*',
-                     'TLC': r'TLC.*',
-                     'RV': r'RV .*',
-                     'RV_TLC': r'RV/TLC.*'
-                     }
+    def extract(self):
+        self._extract_fields()
 
-        for i in lung_func:
-            self.extracted[i] = self.extract_lung_func(lung_func[i], i)
+        rows = self.tokenize_table()
+        for label, key in self.lung_func.items():
+            self.extracted[key] = self.extract_lung_func(key, rows.get(label, []))
 
-    def extract_lung_func(self, regex: str, measurement: str) -> dict:
-        re_lung = re.compile(regex)
-        re_values = re.compile(r'(-?\d{1,3}\.?\d{0,2})')
+    def tokenize_table(self) -> dict:
+        """
+        Splits the report into lines in a single pass and indexes the lines
+        starting with a results table label
+        Returns {label: [rest of line after the label, ...]} in report order
+        """
+        rows = dict()
+        for line in self.text.splitlines():
+            row = line.split(None, 1)
+            if len(row) > 0 and row[0] in self.lung_func:
+                rows.setdefault(row[0], []).append(row[1] if len(row) > 1 else '')
+        return rows
 
-        #self._log('Extracting {0}'.format(measurement))
+    def extract_lung_func(self, measurement: str, lines: list) -> dict:
+        """
+        Takes the table lines for a measurement and returns its values
+        """
+        if len(lines) == 0:
+            if measurement == 'FEV1':
+                self._log('No FEV1 in record {0}'.format(self.source_file))
+                self.error_code = baseparse.ParseError.PARSE_CANT_EXTRACT
+            elif measurement != 'VC':
+                self._log('No {0} in record {1}'.format(measurement, self.source_file))
+            return {}
 
-        if measurement == 'FEV1':
-            vals = re_values.findall(re_lung.search(self.text).group(0))[1:]
-        elif measurement == 'VC':
-            res = re_lung.findall(self.text)
-            if len(res) == 0:
-                return {}
-            elif len(res) == 1:
-                vals = re_values.findall(res[0])
-            else:
-                vals = re_values.findall(res[1])
+        # VC has a row in the spirometry and the lung volume sections - the
+        # lung volume row comes second
+        if measurement == 'VC' and len(lines) > 1:
+            vals = self.re_values.findall(lines[1])
         else:
-            if re_lung.search(self.text) is None:
-                self._log('No {0} in record {1}'.format(measurement, self.source_file))
-                return {}
-            vals = re_values.findall(re_lung.search(self.text).group(0))
+            vals = self.re_values.findall(lines[0])
         
         if len(vals) == 4:
             return {'Predicted': float(vals[0]),
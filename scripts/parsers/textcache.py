@@ -0,0 +1,139 @@
+# On-disk cache of text extracted from pdfs, keyed by file content
+
+import os
+import hashlib
+import logging
+import zlib
+
+# Environment variables controlling the cache - set LUNGDB_TEXT_CACHE to an
+# empty string to turn it off
+CACHE_DIR_ENV = 'LUNGDB_TEXT_CACHE'
+CACHE_SIZE_ENV = 'LUNGDB_TEXT_CACHE_MB'
+DEFAULT_CACHE_DIR = './logs/textcache'
+DEFAULT_CACHE_MB = 1024
+
+def file_hash(f) -> str:
+    """
+    Returns the sha256 of a file's contents as a hex string
+    """
+    h = hashlib.sha256()
+    with open(f, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class TextCache:
+    """
+    Compressed extracted text, stored as <dir>/<ab>/<sha256>-<backend>.z
+    Keyed by content hash and extractor so a renamed or copied pdf is still a
+    hit, and text from different backends is kept apart
+    When the cache grows past max_bytes the least recently used entries are
+    removed until it is back under 90% of the limit. Use is tracked with file
+    mtimes so it is shared between processes; each process keeps its own
+    running total, so the limit is approximate when several write at once
+    The entries are only listed when a process first writes to the cache, so
+    parse workers that only read it (the usual case once it is warm) don't
+    each scan the whole directory
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok = True)
+        self.entries = None
+        self.total = 0
+
+    def _index(self):
+        """
+        List the cache's entries with their sizes and last use, if not done yet
+        """
+        if self.entries is not None:
+            return
+        self.entries = dict()
+        for sub in os.scandir(self.directory):
+            if sub.is_dir():
+                for e in os.scandir(sub.path):
+                    if e.name.endswith('.z'):
+                        st = e.stat()
+                        self.entries[e.path] = (st.st_size, st.st_mtime)
+        self.total = sum(size for size, _ in self.entries.values())
+
+    def _path(self, digest: str, backend: str) -> str:
+        return os.path.join(self.directory, digest[:2], '{0}-{1}.z'.format(digest, backend))
+
+    def get(self, digest: str, backend: str):
+        """
+        Returns the cached text, or None if it isn't in the cache
+        """
+        path = self._path(digest, backend)
+        try:
+            with open(path, 'rb') as fh:
+                text = zlib.decompress(fh.read()).decode('utf-8')
+            os.utime(path)
+        except (OSError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return text
+
+    def put(self, digest: str, backend: str, text: str):
+        path = self._path(digest, backend)
+        data = zlib.compress(text.encode('utf-8'), 6)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        # Write then rename so other processes never see part of a file
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+        self._index()
+        if path in self.entries:
+            self.total -= self.entries[path][0]
+        self.entries[path] = (len(data), os.stat(path).st_mtime)
+        self.total += len(data)
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until under 90% of max_bytes
+        """
+        target = self.max_bytes * 0.9
+        self._index()
+        for path in list(self.entries):
+            try:
+                st = os.stat(path)
+                self.entries[path] = (st.st_size, st.st_mtime)
+            except OSError:
+                del self.entries[path]
+        self.total = sum(size for size, _ in self.entries.values())
+
+        removed = 0
+        for path, (size, _) in sorted(self.entries.items(), key = lambda e: e[1][1]):
+            if self.total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            del self.entries[path]
+            self.total -= size
+            removed += 1
+        logging.info('Text cache: removed {0} entries, {1} bytes in use'.format(removed, self.total))
+
+_cache = None
+
+def get_text_cache():
+    """
+    Returns the process's TextCache, set up from $LUNGDB_TEXT_CACHE and
+    $LUNGDB_TEXT_CACHE_MB, or None if the cache is turned off
+    """
+    global _cache
+    directory = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+    if directory == '':
+        return None
+    if _cache is None or _cache.directory != directory:
+        size = int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_MB))
+        _cache = TextCache(directory, size * 1024 * 1024)
+    return _cache
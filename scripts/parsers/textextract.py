@@ -0,0 +1,67 @@
+# Backends for getting the text out of a pdf
+
+import os
+import logging
+
+# Environment variable used to choose the backend when none is given
+EXTRACTOR_ENV = 'LUNGDB_EXTRACTOR'
+DEFAULT_EXTRACTOR = 'tika'
+
+class TextExtractor:
+    """
+    Base class for text extraction backends
+    Subclasses implement get_text(), returning the document text or an empty
+    string if there is none
+    """
+    name = None
+
+    def get_text(self, source_file: str) -> str:
+        raise NotImplementedError
+
+class TikaExtractor(TextExtractor):
+    """
+    Apache Tika - sends each file to a Tika server (started on first use)
+    """
+    name = 'tika'
+
+    def get_text(self, source_file: str) -> str:
+        from tika import parser
+        data = parser.from_file(source_file)
+        return (data['content'] if data['content'] is not None else '')
+
+class PdfminerExtractor(TextExtractor):
+    """
+    pdfminer.six - pure Python, runs in process
+    Layout analysis is set up so each row of a table comes out as one line
+    with its cells separated by spaces, as Tika does
+    """
+    name = 'pdfminer'
+
+    def __init__(self):
+        from pdfminer.high_level import extract_text
+        from pdfminer.layout import LAParams
+        self.extract_text = extract_text
+        self.laparams = LAParams(char_margin = 100.0, line_margin = 0.3, boxes_flow = None)
+
+    def get_text(self, source_file: str) -> str:
+        return self.extract_text(source_file, laparams = self.laparams)
+
+EXTRACTORS = {TikaExtractor.name: TikaExtractor,
+              PdfminerExtractor.name: PdfminerExtractor}
+
+_instances = dict()
+
+def get_extractor(name: str = None) -> TextExtractor:
+    """
+    Returns the extractor called name, or the one set in $LUNGDB_EXTRACTOR
+    (default tika) if name is None
+    One instance of each backend is kept per process
+    """
+    if name is None:
+        name = os.environ.get(EXTRACTOR_ENV, DEFAULT_EXTRACTOR)
+    if not name in EXTRACTORS:
+        raise ValueError('Unknown text extractor: {0}'.format(name))
+    if not name in _instances:
+        logging.info('Using {0} text extractor'.format(name))
+        _instances[name] = EXTRACTORS[name]()
+    return _instances[name]
@@ -7,20 +7,28 @@ sys.path.insert(0, folder)
 
 from pathlib import Path
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-import scripts.database.db as db
-from parsers.parsers import Parsetype
-from parsers.pft import PFTParse
-
+import argparse
 import datetime as dt
-from dateutil import parser as dtparser
+import signal
+from functools import partial
+
+from scripts.database.engine import Database, DB_URL_ENV, DEFAULT_DB_URL
+from scripts.database.manifest import Manifest
+from scripts.database.jobs import ImportJob, JOB_FAILED, list_jobs
+from scripts.database.quarantine import Quarantine, SNIPPET_SIZE, redrive, quarantined
+from scripts.database.writer import BatchWriter
+from scripts.ingest.pipeline import Pipeline
+import scripts.ingest.metrics as metrics
+import scripts.ingest.walker as walker
+from scripts.ingest.watcher import Watcher
+from scripts.parsers.parsers import Parsetype, parse_file
+import scripts.parsers.textextract as textextract
+import scripts.parsers.textcache as textcache
 
-# Set up database connection
-engine = create_engine('sqlite:///.///logs///pfts.db')
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+# Database connection - set up by connect()
+database = None
+session = None
+writer = None
 
 # Set up logging
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO, \
@@ -28,156 +36,394 @@ logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO, \
 
 #logging.info('Java directory: {0}'.format(os.environ['TIKA_SERVER_JAR']))
 
+def connect(url: str = None, **engine_options):
+    """
+    Open the database at url (default $LUNGDB_DB_URL or ./logs/pfts.db) and
+    set up the session and batch writer used by read_dir()
+    """
+    global database, session, writer
+    database = Database(url, **engine_options)
+    session = database.session()
+    writer = BatchWriter(database.engine)
+
 def main():
+    args = get_args()
     logging.info('Starting main - scanpfts.py')
-    p = Path('./data') # Replace this with pft directory
-    read_dir(p)
+    connect(args.db, echo = args.db_echo)
+    if args.extractor is not None:
+        # Set in the environment so pool workers pick it up too
+        os.environ[textextract.EXTRACTOR_ENV] = args.extractor
+    dirs = [Path(d) for d in (args.dir if args.dir is not None else ['./data'])]
+    writer.batch_size = args.batch_size
+    writer.max_seconds = args.batch_seconds
+    ptype = (Parsetype[args.parser] if args.parser != 'auto' else None)
+    if args.metrics:
+        # Set in the environment so pool workers time their stages too
+        os.environ[metrics.METRICS_ENV] = '1'
+    m = metrics.reset(args.metrics, args.metrics_top)
+    if args.list_jobs:
+        for job in list_jobs(database.engine):
+            print('{0:5d}  {2:8s}  {3}/{4} files  {5:%Y-%m-%d %H:%M}  {1}'.format(*job))
+        return
+    if args.list_quarantine:
+        for q in quarantined(session):
+            retry = ('{0:%Y-%m-%d %H:%M}'.format(q.next_retry) if q.next_retry is not None else 'given up')
+            print('{0}  {1}  {2} attempts, retry {3}\n    {4}'.format(q.path, q.outcome, q.attempts, retry, q.error))
+        return
+    if args.redrive is not None:
+        n = redrive(session, (args.redrive if args.redrive != 'all' else None))
+        print('{0} quarantined files will be read by this scan'.format(n))
+    if args.resume is not None:
+        if args.bulk_load:
+            with database.bulk_load():
+                resume(args.resume, args.workers)
+        else:
+            resume(args.resume, args.workers)
+    elif args.watch:
+        watch(dirs, ptype, args.settle, args.poll_interval, not args.no_inotify, **walk_options(args))
+    elif args.bulk_load:
+        with database.bulk_load():
+            for p in dirs:
+                read_dir(p, args.workers, args.full, ptype, **walk_options(args))
+    else:
+        for p in dirs:
+            read_dir(p, args.workers, args.full, ptype, **walk_options(args))
+    if args.metrics:
+        m.log_summary()
+        m.write_json(args.metrics_json)
+        m.write_prometheus(args.metrics_prom)
 
-def read_dir(p: Path):
+def get_args() -> argparse.Namespace:
     """
-    Recursively read through a directory and subdirectories
-    For each pdf file found, extract PFT results by calling parse_pdf()
+    Command line options for scanpfts.py
     """
-    logging.info('Reading {0}'.format(p.name))
-    for f in p.glob('*.pdf'):
-        if 'TREND' in str(f): continue
-        parse_pdf(f, Parsetype.PT_FULL_PFT)
-    for d in [x for x in p.iterdir() if x.is_dir()]:
-        read_dir(d)
+    ap = argparse.ArgumentParser(description='Read PFT results from pdf into the database')
+    ap.add_argument('--dir', action='append', metavar='DIR', \
+                    help='Directory of pdfs to read (default ./data, may be repeated)')
+    ap.add_argument('--watch', action='store_true', \
+                    help='Keep running and read new and changed files as they arrive')
+    ap.add_argument('--settle', type=float, default=2.0, \
+                    help='With --watch, seconds a file must be unmodified before it is read')
+    ap.add_argument('--poll-interval', type=float, default=5.0, \
+                    help='With --watch, seconds between checks of the directories when polling')
+    ap.add_argument('--no-inotify', action='store_true', \
+                    help='With --watch, poll the directories even where inotify is available')
+    ap.add_argument('--workers', type=int, default=1, \
+                    help='Number of processes used to parse pdfs (default 1 - no pool)')
+    ap.add_argument('--resume', type=int, default=None, metavar='JOB_ID', \
+                    help='Carry on with an import job that stopped part way, with its original options')
+    ap.add_argument('--list-jobs', action='store_true', help='List recent import jobs and exit')
+    ap.add_argument('--list-quarantine', action='store_true', \
+                    help='List the files quarantined after failing to be read and exit')
+    ap.add_argument('--redrive', nargs='?', const='all', default=None, metavar='OUTCOME', \
+                    help='Retry quarantined files now (all, or only those that failed with OUTCOME)')
+    ap.add_argument('--full', action='store_true', \
+                    help='Re-parse every file, even those unchanged since the last scan')
+    ap.add_argument('--parser', choices=['auto'] + [x.name for x in Parsetype], default='auto', \
+                    help='Parser to use for every file (default auto - chosen per file from its contents)')
+    ap.add_argument('--extractor', choices=list(textextract.EXTRACTORS), default=None, \
+                    help='Text extraction backend (default ${0} or {1})'.format( \
+                        textextract.EXTRACTOR_ENV, textextract.DEFAULT_EXTRACTOR))
+    ap.add_argument('--db', default=None, metavar='URL', \
+                    help='Database url (default ${0} or {1})'.format(DB_URL_ENV, DEFAULT_DB_URL))
+    ap.add_argument('--db-echo', action='store_true', help='Log every SQL statement')
+    ap.add_argument('--bulk-load', action='store_true', \
+                    help='Faster, less durable SQLite settings for a large import - restored afterwards')
+    ap.add_argument('--batch-size', type=int, default=500, \
+                    help='Number of reports written to the database per transaction')
+    ap.add_argument('--batch-seconds', type=float, default=30.0, \
+                    help='Longest time reports are held before being written')
+    ap.add_argument('--include', action='append', metavar='GLOB', \
+                    help='File names to read (default *.pdf, may be repeated)')
+    ap.add_argument('--exclude', action='append', metavar='GLOB', \
+                    help='Paths relative to the data directory to skip (default *TREND*, may be repeated)')
+    ap.add_argument('--max-depth', type=int, default=None, \
+                    help='Number of levels of subdirectory to read (default no limit)')
+    ap.add_argument('--symlinks', choices=walker.SYMLINK_POLICIES, default=walker.SYMLINKS_FOLLOW, \
+                    help='How to treat symbolic links (default follow)')
+    ap.add_argument('--modified-since', type=dt.date.fromisoformat, default=None, metavar='YYYY-MM-DD', \
+                    help='Only read files modified on or after this date')
+    ap.add_argument('--metrics', action='store_true', \
+                    help='Time each stage of the run and write a summary')
+    ap.add_argument('--metrics-top', type=int, default=10, \
+                    help='Number of slowest files listed in the summary')
+    ap.add_argument('--metrics-json', default='./logs/ingest_metrics.json', \
+                    help='Where to write the run summary (default ./logs/ingest_metrics.json)')
+    ap.add_argument('--metrics-prom', default='./logs/lungdb_ingest.prom', \
+                    help='Where to write the Prometheus textfile (default ./logs/lungdb_ingest.prom)')
+    return ap.parse_args()
 
-def parse_pdf(f: Path, p: Parsetype):
+def walk_options(args: argparse.Namespace) -> dict:
     """
-    Takes a path to a pdf file and a parser to use
-    Extracts data from file and adds to database
+    Keyword arguments for walker.walk() from the command line options
     """
-    if p == Parsetype.PT_FULL_PFT:
-        logging.info('Parsing {0} as PT_FULL_PFT'.format(f.name))
-        result = PFTParse(f)
+    opts = {'max_depth': args.max_depth, 'symlinks': args.symlinks}
+    if args.include is not None:
+        opts['include'] = tuple(args.include)
+    if args.exclude is not None:
+        opts['exclude'] = tuple(args.exclude)
+    if args.modified_since is not None:
+        opts['modified_since'] = dt.datetime.combine(args.modified_since, dt.time()).timestamp()
+    return opts
 
-    else:
-        logging.error('Unrecognised parser for file {0}'.format(f.name))
-        return
-
-    if result.is_any_data():
-        add_to_db(result.get_data(), p)
-        
-    else:
-        logging.error('Failed to extract from {0}'.format(result.get_sourcefile()))     
-
-def add_to_db(rec: dict, p: Parsetype):
+def read_dir(p: Path, workers: int = 1, full: bool = False, ptype: Parsetype = None, \
+             job: ImportJob = None, **walk_opts):
     """
-    Add a record to the database
-    p determines type of record
+    Read through a directory and subdirectories
+    For each new or changed pdf file found, extract the results and add them to
+    the database. Each file is read with the parser for its type of report
+    unless ptype is given. Files whose fingerprint matches the ingest manifest are
+    skipped unless full is set
+    Files are found by walker.walk(), walk_opts are passed on to it
+    Runs as a pipeline: the directory walk, parsing (in a pool of workers
+    processes if workers > 1) and database writes all overlap. Records are
+    added to the database in the same order as a serial scan
+    The scan is recorded as an import job (a new one unless job is given, see
+    resume()) with a checkpoint after each batch is written
     """
-    if 'RXR' in rec:
-        # Check if RXR in db
-        rxrrec = session.query(db.Patient).filter(db.Patient.rxr == rec['RXR'].upper()).first()
-        if rxrrec is None:
-            # Make new rxr record
-            rxrrec = db.Patient(rxr = rec['RXR'].upper(), \
-                                dob = (dtparser.parse(rec['dob']).date() if 'dob' in rec else None), \
-                                lname = (rec['lname'].lower().capitalize() if 'lname' in rec else None), \
-                                fname = (rec['fname'].lower().capitalize() if 'fname' in rec else None), \
-                                sex = (rec['sex'].lower().capitalize() if 'sex' in rec else None))
+    if database is None:
+        connect()
+    if job is None:
+        job = ImportJob.create(database.engine, p, {'full': full, \
+                                                    'parser': (ptype.name if ptype is not None else None), \
+                                                    'walk': walk_opts})
+    manifest = Manifest(session)
+    quarantine = Quarantine(session)
+    def checkpoint():
+        # Commits the quarantine too, as it shares the session
+        manifest.commit()
+        job.checkpoint()
+    writer.after_flush = checkpoint
+    writer.load_patients()
+    counts = {'parse': 0, 'skip': 0, 'held': 0}
+    m = metrics.get_metrics()
+
+    def check(f: Path) -> bool:
+        with m.stage('fingerprint'):
+            held = (not full and quarantine.is_held(f))
+            unchanged = (not full and not held and not quarantine.is_due(f) and manifest.is_unchanged(f))
+        if held:
+            counts['held'] += 1
+            m.count('outcome', 'QUARANTINED')
+        elif unchanged:
+            counts['skip'] += 1
+            m.count('outcome', 'UNCHANGED')
         else:
-            # TODO check for inconsistencies in name & dob
-            pass
-        
-        if 'height' in rec:
-            phys = db.Physiology(subject = rxrrec, \
-                                 study_date = (dtparser.parse(rec['date']).date() if 'date' in rec else None), \
-                                 height = (rec['height'] if 'height' in rec else None), \
-                                 weight = (rec['weight'] if 'weight' in rec else None))
-            session.add(phys)
-        
-        if p is Parsetype.PT_FULL_PFT:
-            spirorec = db.Spirometry(subject = rxrrec, \
-                                     study_date = (dtparser.parse(rec['date']).date() if 'date' in rec else None))
-
-            spirorec.fev1_pre, spirorec.fev1_pred, spirorec.fev1_pre_percent_pred, spirorec.fev1_pre_SR, \
-                spirorec.fev1_post, spirorec.fev1_percent_change, spirorec.fev1_post_percent_pred, \
-                spirorec.fev1_post_SR = get_spiro_vals('FEV1', rec)
-
-            spirorec.fvc_pre, spirorec.fvc_pred, spirorec.fvc_pre_percent_pred, spirorec.fvc_pre_SR, \
-                spirorec.fvc_post, spirorec.fvc_percent_change, spirorec.fvc_post_percent_pred, \
-                spirorec.fvc_post_SR = get_spiro_vals('FVC', rec)
-            
-            if 'TLco' in rec: # TLco added but empty - test len(TLco) instead??
-                lungrec = db.Lungfunc(subject = rxrrec, \
-                            study_date = (dtparser.parse(rec['date']).date() if 'date' in rec else None), \
-                            spiro = spirorec)
-
-                lungrec.tlco, lungrec.tlco_pred, lungrec.tlco_percent_pred, \
-                    lungrec.tlco_SR = get_pft_vals('TLco', rec)
-                lungrec.vasb, lungrec.vasb_pred, lungrec.vasb_percent_pred, \
-                    _ = get_pft_vals('VAsb', rec)
-                lungrec.kco, lungrec.kco_pred, lungrec.kco_percent_pred, \
-                    _ = get_pft_vals('KCO', rec)
-                lungrec.frc, lungrec.frc_pred, lungrec.frc_percent_pred, \
-                    lungrec.frc_SR = get_pft_vals('FRC', rec)
-                lungrec.vc, lungrec.vc_pred, lungrec.vc_percent_pred, \
-                    lungrec.vc_SR = get_pft_vals('VC', rec)
-                lungrec.tlc, lungrec.tlc_pred, lungrec.tlc_percent_pred, \
-                    lungrec.tlc_SR = get_pft_vals('TLC', rec)
-                lungrec.rv, lungrec.rv_pred, lungrec.rv_percent_pred, \
-                    lungrec.rv_SR = get_pft_vals('RV', rec)
-                lungrec.tlcrv, lungrec.tlcrv_pred, lungrec.tlcrv_percent_pred, \
-                    lungrec.tlcrv_SR = get_pft_vals('RV_TLC', rec)
-
-                session.add(lungrec)
+            counts['parse'] += 1
+        return not (held or unchanged)
 
+    def todo():
+        # Files left over from an earlier run of the job - the manifest
+        # catches any that were written after its last checkpoint
+        for f in job.remaining():
+            if not f.exists():
+                job.mark(f, 'MISSING')
+            elif check(f):
+                yield f
             else:
-                logging.info('{0}: Adding isolated spiro'.format(rec['RXR']))
-                session.add(spirorec)
+                job.mark(f, 'SKIPPED')
+        if job.walked:
+            return
+        files = walker.walk(p, **walk_opts)
+        while True:
+            with m.stage('walk'):
+                f = next(files, None)
+            if f is None:
+                break
+            if job.has(f):
+                continue
+            if check(f):
+                job.add(f)
+                yield f
+        job.walk_finished()
 
-        
-        else:
-            logging.error('Problem adding record!')
+    def finish():
+        writer.flush()
+        checkpoint()
+        logging.info('{0} files parsed, {1} unchanged since last scan, {2} quarantined'.format( \
+            counts['parse'], counts['skip'], counts['held']))
+        logging.info(writer.patients.summary())
 
-        session.commit()
+    pipe = Pipeline(partial(parse_worker, p = ptype), \
+                    lambda f, res: store_result(f, res, manifest, job, quarantine), \
+                    finish, workers, crash_result = (None, 'WORKER_DIED', ptype, \
+                                                     'Worker process died', None, None))
+    try:
+        pipe.run(todo())
+    except BaseException:
+        job.finish(JOB_FAILED)
+        logging.error('Import job {0} stopped - carry on with --resume {0}'.format(job.id))
+        raise
+    job.finish()
 
-    else:
-        logging.error('Tried to add record with no RXR')
+def resume(job_id: int, workers: int = 1):
+    """
+    Carry on with an import job that stopped part way, with the options it was
+    started with. Files it finished aren't read again, and if it had found
+    every file the directory isn't walked again
+    """
+    if database is None:
+        connect()
+    try:
+        job = ImportJob.resume(database.engine, job_id)
+    except ValueError as e:
+        logging.error(str(e))
+        sys.exit(str(e))
+    ptype = (Parsetype[job.options['parser']] if job.options['parser'] is not None else None)
+    walk_opts = job.options['walk']
+    for k in ['include', 'exclude']:
+        if k in walk_opts:
+            walk_opts[k] = tuple(walk_opts[k])
+    read_dir(job.root, workers, job.options['full'], ptype, job, **walk_opts)
+
+def watch(dirs: list, ptype: Parsetype = None, settle: float = 2.0, interval: float = 5.0, \
+          use_inotify: bool = True, **walk_opts):
+    """
+    Read new and changed pdfs from dirs as they arrive, until interrupted or
+    sent SIGTERM
+    Runs in one process, so the text extractor, database session and patient
+    cache stay loaded between files. Files are found by a Watcher (inotify
+    where available, otherwise polling) and checked against the ingest
+    manifest; each batch is parsed and committed as soon as it is ready
+    rather than waiting for a full chunk
+    """
+    if database is None:
+        connect()
+    manifest = Manifest(session)
+    quarantine = Quarantine(session)
+    writer.after_flush = manifest.commit
+    writer.load_patients()
+    watcher = Watcher(dirs, settle, interval, use_inotify = use_inotify, **walk_opts)
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    logging.info('Watching {0}'.format(', '.join(str(d) for d in dirs)))
+    try:
+        for files in watcher.batches():
+            try:
+                n = 0
+                for f in files:
+                    if quarantine.is_held(f) or (not quarantine.is_due(f) and manifest.is_unchanged(f)):
+                        continue
+                    store_result(f, parse_worker(f, ptype), manifest, quarantine = quarantine)
+                    n += 1
+                if n > 0:
+                    writer.flush()
+                    manifest.commit()
+                    logging.info('{0} files read'.format(n))
+            except Exception:
+                # Keep watching - the files are tried again if they change
+                logging.exception('Failed to read batch of {0} files'.format(len(files)))
+                session.rollback()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        writer.flush()
+        manifest.commit()
+        logging.info('Stopped watching')
+
+def parse_pdf(f: Path, p: Parsetype = None, manifest: Manifest = None):
+    """
+    Takes a path to a pdf file and a parser to use (None to pick one from
+    the file's contents)
+    Extracts data from file and adds to database
+    """
+    if database is None:
+        connect()
+    store_result(f, parse_worker(f, p), manifest)
 
-def get_spiro_vals(key: str, rec: dict) -> tuple:
+def parse_worker(f: Path, p: Parsetype = None) -> tuple:
     """
-    Takes a spirometry test (eg FEV1, FVC, etc) as key and returns an 8-tuple
-    with pre then post measured, %predicted, SR as well as predicted and percent change
-    Fills tuple position with None if value doesn't exist
+    Parse a single pdf - runs in a worker process when using a pool
+    Returns a tuple of (extracted data, outcome, parser type, error, text,
+    stage times). data is None on failure and outcome is the name of the
+    parser's ParseError code. On failure error describes it and text is the
+    start of the file's text if it has been extracted. Stage times are None
+    unless metrics are on
+    Exceptions are logged rather than raised so one bad pdf can't end the run
     """
-    if not key in rec:
-        logging.error('Lung function, get_spiro_vals() - no data found')
-        return (None, None, None, None, None, None, None, None)
+    m = metrics.get_metrics()
+    m.begin_file()
+    res = _parse(f, p)
+    return res + (m.end_file(),)
 
-    pre = rec[key]['Measured_pre']
-    pred = rec[key]['Predicted']
-    pre_percent_pred = rec[key]['Percent_pred_pre']
-    pre_SR = (rec[key]['SR_pre'] if 'SR_pre' in rec[key] else None)
+def _parse(f: Path, p: Parsetype = None) -> tuple:
+    try:
+        p, result = parse_file(f, p)
+        if result is None:
+            logging.error('Unrecognised report type for file {0}'.format(f.name))
+            return (None, 'NO_PARSER', None, 'Unrecognised report type', cached_text(f))
+        logging.info('Parsed {0} as {1}'.format(f.name, p.name))
 
-    post = (rec[key]['Measured_post'] if 'Measured_post' in rec[key] else None)
-    post_percent_pred = (rec[key]['Percent_pred_post'] if 'Percent_pred_post' in rec[key] else None)
-    percent_change = (rec[key]['Percent_change'] if 'Percent_change' in rec[key] else None)
-    post_SR = (rec[key]['SR_post'] if 'SR_post' in rec[key] else None)
+    except Exception as e:
+        logging.exception('Error parsing {0}'.format(f.name))
+        return (None, 'EXCEPTION', p, '{0}: {1}'.format(type(e).__name__, e), cached_text(f))
 
-    return (pre, pred, pre_percent_pred, pre_SR, post, percent_change, post_percent_pred, post_SR)
+    if result.is_any_data():
+        return (result.get_data(), result.error_code.name, p, None, None)
+        
+    else:
+        logging.error('Failed to extract from {0}'.format(result.get_sourcefile()))
+        text = getattr(result, 'text', None)
+        error = ('; '.join(m.strip() for m in result.messages) if len(result.messages) > 0 else 'No results could be extracted')
+        return (None, result.error_code.name, p, error, (text[:SNIPPET_SIZE] if text else None))
 
-def get_pft_vals(key: str, rec: dict) -> tuple:
+def cached_text(f: Path) -> str:
     """
-    Takes a lung function test (eg TLco, etc) as key and returns an 4-tuple
-    with measured, predicted, %predicted, SR 
-    Fills tuple position with None if value doesn't exist
-    Use get_spiro_vals() for measures with reversibility
+    The start of the text of f if it has already been extracted, otherwise
+    None - shows what a failed file looked like without extracting it again
     """
-    if not key in rec:
-        logging.error('Lung function, get_pft_vals() - no data found')
-        return (None, None, None, None)
+    cache = textcache.get_text_cache()
+    if cache is None:
+        return None
+    try:
+        text = cache.get(textcache.file_hash(f), textextract.get_extractor().name)
+    except (OSError, ValueError):
+        return None
+    return (text[:SNIPPET_SIZE] if text else None)
 
-    measured = (rec[key]['Measured_pre'] if 'Measured_pre' in rec[key] else None)
-    pred = (rec[key]['Predicted'] if 'Predicted' in rec[key] else None)
-    percent = (rec[key]['Percent_pred_pre'] if 'Percent_pred_pre' in rec[key] else None)
-    sr = (rec[key]['SR_pre'] if 'SR_pre' in rec[key] else None)
+def store_result(f: Path, res: tuple, manifest: Manifest = None, job: ImportJob = None, \
+                 quarantine: Quarantine = None):
+    """
+    Takes the (data, outcome, parser type, error, text, stage times) tuple
+    from parse_worker() for file f, adds the data to the database and records f
+    in the manifest (and marks it done in job) once it is written
+    If quarantine is given a file that fails, to be parsed or written, is
+    quarantined and one that succeeds released
+    Called from the pipeline's writer thread
+    """
+    data, outcome, p, error, text, stats = res
+    m = metrics.get_metrics()
+    m.add_file(f, stats)
+    m.count('outcome', outcome)
+    done = None
+    failed = None
+    if manifest is not None:
+        pname = (p.name if p is not None else None)
+        def done(row_ids):
+            manifest.record(f, pname, outcome, row_ids)
+            if quarantine is not None:
+                if data is None:
+                    quarantine.add(f, outcome, error, text)
+                else:
+                    quarantine.release(f)
+            if job is not None:
+                job.mark(f, outcome)
+    if quarantine is not None:
+        def failed(e):
+            quarantine.add(f, 'WRITE_ERROR', '{0}: {1}'.format(type(e).__name__, e), cached_text(f))
+            if job is not None:
+                job.mark(f, 'WRITE_ERROR')
+    add_to_db(data, p, done, failed)
 
-    return (measured, pred, percent, sr)
+def add_to_db(rec: dict, p: Parsetype, done = None, failed = None):
+    """
+    Add a record to the database
+    p determines type of record
+    Records are queued on the batch writer; done, if given, is called with the
+    ids of the rows added as {table name: [ids]} once they are committed, and
+    failed with the exception if the record's values can't be stored
+    """
+    writer.add(rec, p, done, failed)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file